@@ -0,0 +1,160 @@
+"""
+Batch analysis over many positions, spread across processes.
+GameState is pure Python, so one process can only use one core; the batch runner starts a pool of
+worker processes, each holding one GameState and one Searcher that are reused for every task it is
+given. Tasks go out in chunks to keep the inter-process traffic down, and results come back in
+input order as soon as they are ready, with only a few chunks in flight at a time so the input
+can be as long as it likes.
+
+Usage:
+    python chessBatch.py positions.epd --task moves
+    python chessBatch.py positions.epd --task perft --depth 3 --workers 8
+    python chessBatch.py positions.epd --task bestmove --depth 5 --bitboard --out results.jsonl
+
+Each input line is a FEN or an EPD record; every result is written as one JSON line.
+"""
+
+import argparse
+import concurrent.futures
+import itertools
+import json
+import os
+import sys
+import time
+
+import chessEngine
+import chessBitboard
+import chessEpd
+import chessPerft
+import chessSearch
+
+taskKinds = ("moves","perft","bestmove")
+
+# the game state and searcher of this worker process, made once by initWorker
+workerGameState = None
+workerSearcher = None
+
+
+def initWorker(bitboard = False,ttSize = 1 << 16):
+    global workerGameState,workerSearcher
+    workerGameState = chessBitboard.BitboardGameState() if bitboard else chessEngine.GameState()
+    workerSearcher = chessSearch.Searcher(ttSize)
+
+
+'''
+Analyse one position with the worker's game state. task is (kind, fen, depth).
+Returns a dict that can be written out as JSON; a bad FEN, or any failure while analysing the
+position, gives an "error" entry instead of raising. The next task loads a new position, so a
+failure leaves nothing behind in the worker.
+'''
+def runTask(task):
+    if workerGameState is None:
+        initWorker()
+    kind,fen,depth = task
+    result = {"fen":fen,"task":kind}
+    try:
+        workerGameState.loadFen(fen)
+    except ValueError as error:
+        result["error"] = str(error)
+        return result
+    start = time.perf_counter()
+    try:
+        if kind == "moves":
+            result["moves"] = len(workerGameState.getLegalMoves())
+        elif kind == "perft":
+            result["depth"] = depth
+            result["nodes"] = chessPerft.perft(workerGameState,depth)
+        elif kind == "bestmove":
+            search = workerSearcher.findBestMove(workerGameState,maxDepth = depth)
+            result["depth"] = search.depth
+            result["bestmove"] = search.bestMove.getChessNotation() if search.bestMove is not None else None
+            result["score"] = search.score
+            result["pv"] = [move.getChessNotation() for move in search.pv]
+            result["nodes"] = search.nodes
+        else:
+            result["error"] = "unknown task "+kind
+    except Exception as error: # one position the engine cannot handle must not end the whole batch
+        result["error"] = "%s: %s" % (type(error).__name__,error)
+        return result
+    result["seconds"] = round(time.perf_counter()-start,4)
+    return result
+
+
+def runChunk(tasks):
+    return [runTask(task) for task in tasks]
+
+
+'''
+Run tasks ((kind, fen, depth) tuples, any iterable) on a pool of worker processes and yield
+the results in the same order. workers defaults to every core. At most inFlight chunks of
+chunkSize tasks are queued at once, so a long input is read as the results are consumed.
+'''
+def runBatch(tasks,workers = None,chunkSize = 16,bitboard = False,ttSize = 1 << 16,inFlight = None):
+    workers = workers or os.cpu_count() or 1
+    inFlight = inFlight or 2*workers
+    tasks = iter(tasks)
+    with concurrent.futures.ProcessPoolExecutor(workers,initializer = initWorker,initargs = (bitboard,ttSize)) as executor:
+        pending = [] # futures in input order
+        while True:
+            while len(pending) < inFlight:
+                chunk = list(itertools.islice(tasks,chunkSize))
+                if not chunk:
+                    break
+                pending.append(executor.submit(runChunk,chunk))
+            if not pending:
+                return
+            yield from pending.pop(0).result()
+
+
+'''
+FENs from a file with one FEN or EPD record per line
+'''
+def readPositions(source):
+    if isinstance(source,str):
+        with chessEpd.openText(source) as lines:
+            yield from readPositions(lines)
+        return
+    for line in source:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        fields = line.split()
+        if len(fields) == 6 and fields[4].isdigit() and fields[5].isdigit():
+            yield line
+        else:
+            try:
+                yield chessEpd.parseEpdLine(line)[0]
+            except ValueError:
+                yield line # passed on so the result reports the error in order
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Analyse many positions in parallel")
+    parser.add_argument("input",help = "file with one FEN or EPD record per line ('-' for stdin)")
+    parser.add_argument("--task",choices = taskKinds,default = "moves",help = "legal move count, perft or best move")
+    parser.add_argument("--depth",type = int,default = 3,help = "perft depth or search depth")
+    parser.add_argument("--workers",type = int,help = "number of processes (default: every core)")
+    parser.add_argument("--chunk-size",type = int,default = 16,help = "positions sent to a worker at a time")
+    parser.add_argument("--bitboard",action = "store_true",help = "use the bitboard backend")
+    parser.add_argument("--out",help = "write the JSON lines here instead of stdout")
+    args = parser.parse_args(argv)
+
+    positions = readPositions(sys.stdin if args.input == '-' else args.input)
+    tasks = ((args.task,fen,args.depth) for fen in positions)
+    out = open(args.out,"w") if args.out else sys.stdout
+    start = time.perf_counter()
+    count = 0
+    try:
+        for result in runBatch(tasks,args.workers,args.chunk_size,args.bitboard):
+            out.write(json.dumps(result)+"\n")
+            count += 1
+    finally:
+        if args.out:
+            out.close()
+    seconds = time.perf_counter()-start
+    print("%d positions in %.2fs (%.1f per second)" % (count,seconds,count/seconds if seconds else 0),file = sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,471 @@
+"""
+Bitboard backend for the chess engine.
+Keeps one 64-bit integer per piece type and colour next to the usual 8x8 board
+and uses precomputed attack tables for move generation and attack queries.
+Squares are numbered along the board rows: square = row*8 + col, so a8 is 0 and h1 is 63.
+"""
+
+import chessEngine
+
+knightOffsets = ((-2,-1),(-2,1),(-1,-2),(-1,2),(1,-2),(1,2),(2,-1),(2,1))
+kingOffsets = ((-1,-1),(-1,0),(-1,1),(0,-1),(0,1),(1,-1),(1,0),(1,1))
+
+# the four lines a sliding piece can move along, each as a pair of opposite directions
+rankDirections = ((0,-1),(0,1))
+fileDirections = ((-1,0),(1,0))
+diagonalDirections = ((-1,-1),(1,1))
+antiDiagonalDirections = ((-1,1),(1,-1))
+
+allSquares = (1 << 64)-1
+rank2 = 0xFF << 48 # white pawns start on row 6
+rank7 = 0xFF << 8 # black pawns start on row 1
+# the low bits of the Move.fromSquares pool key of every move that is not a promotion, castle or en-passant
+plainMoveKeyBits = chessEngine.Move.promotionCodes['Q'] << 2
+
+
+def squareBit(r,c):
+    return 1 << (r*8+c)
+
+
+'''
+Attack set of a piece that makes single steps (knight, king, pawn captures) from every square
+'''
+def buildStepAttacks(offsets):
+    table = []
+    for sq in range(64):
+        r,c = divmod(sq,8)
+        attacks = 0
+        for dr,dc in offsets:
+            if 0 <= r+dr < 8 and 0 <= c+dc < 8:
+                attacks |= squareBit(r+dr,c+dc)
+        table.append(attacks)
+    return tuple(table)
+
+
+'''
+Squares reached from sq along the given directions, stopping at (and including) the first occupied square
+'''
+def rayAttacks(sq,directions,occupied):
+    r,c = divmod(sq,8)
+    attacks = 0
+    for dr,dc in directions:
+        endRow,endCol = r+dr,c+dc
+        while 0 <= endRow < 8 and 0 <= endCol < 8:
+            bit = squareBit(endRow,endCol)
+            attacks |= bit
+            if occupied & bit:
+                break
+            endRow += dr
+            endCol += dc
+    return attacks
+
+
+'''
+Squares on a line whose occupancy can change the attack set from sq.
+The last square in every direction is left out - a blocker there stops nothing.
+'''
+def relevantMask(sq,directions):
+    r,c = divmod(sq,8)
+    mask = 0
+    for dr,dc in directions:
+        endRow,endCol = r+dr,c+dc
+        while 0 <= endRow+dr < 8 and 0 <= endCol+dc < 8:
+            mask |= squareBit(endRow,endCol)
+            endRow += dr
+            endCol += dc
+    return mask
+
+
+'''
+Precompute the attacks along one line for every square and every occupancy of that line.
+Looking up occupied & mask in the table does the job of the rotated bitboards / magic multiply:
+the masked occupancy is already a unique key, and a dict hashes it for us.
+'''
+def buildLineAttacks(directions):
+    masks = []
+    tables = []
+    for sq in range(64):
+        mask = relevantMask(sq,directions)
+        table = {}
+        subset = 0
+        while True: # enumerate every subset of the mask (carry-rippler)
+            table[subset] = rayAttacks(sq,directions,subset)
+            subset = (subset-mask) & mask
+            if subset == 0:
+                break
+        masks.append(mask)
+        tables.append(table)
+    return tuple(masks),tuple(tables)
+
+
+knightAttacks = buildStepAttacks(knightOffsets)
+kingAttacks = buildStepAttacks(kingOffsets)
+# squares attacked by a pawn of the given colour standing on each square
+pawnAttacks = {'w':buildStepAttacks(((-1,-1),(-1,1))),'b':buildStepAttacks(((1,-1),(1,1)))}
+
+rankMasks,rankAttacks = buildLineAttacks(rankDirections)
+fileMasks,fileAttacks = buildLineAttacks(fileDirections)
+diagonalMasks,diagonalAttacks = buildLineAttacks(diagonalDirections)
+antiDiagonalMasks,antiDiagonalAttacks = buildLineAttacks(antiDiagonalDirections)
+
+
+'''
+between[a][b] - squares strictly between two squares on a common line (0 when they are not aligned)
+line[a][b] - the whole line through both squares, used to keep pinned pieces on the pin
+'''
+def buildLineTables():
+    between = [[0]*64 for _ in range(64)]
+    line = [[0]*64 for _ in range(64)]
+    for sq in range(64):
+        r,c = divmod(sq,8)
+        for dr,dc in kingOffsets:
+            fullLine = rayAttacks(sq,((dr,dc),(-dr,-dc)),0) | (1 << sq)
+            squares = 0
+            endRow,endCol = r+dr,c+dc
+            while 0 <= endRow < 8 and 0 <= endCol < 8:
+                target = endRow*8+endCol
+                between[sq][target] = squares
+                line[sq][target] = fullLine
+                squares |= 1 << target
+                endRow += dr
+                endCol += dc
+    return between,line
+
+between,line = buildLineTables()
+
+
+def rookAttacks(sq,occupied):
+    return rankAttacks[sq][occupied & rankMasks[sq]] | fileAttacks[sq][occupied & fileMasks[sq]]
+
+def bishopAttacks(sq,occupied):
+    return diagonalAttacks[sq][occupied & diagonalMasks[sq]] | antiDiagonalAttacks[sq][occupied & antiDiagonalMasks[sq]]
+
+def queenAttacks(sq,occupied):
+    return rookAttacks(sq,occupied) | bishopAttacks(sq,occupied)
+
+
+class BitboardGameState(chessEngine.GameState):
+    '''
+    Drop-in replacement for GameState that generates moves from bitboards.
+    self.board is still kept up to date so the UI and Move objects work unchanged.
+    '''
+
+    def __init__(self,moveCache = None) -> None:
+        super().__init__(moveCache)
+        self.syncBitboards()
+
+    '''
+    Rebuild the bitboards from self.board
+    '''
+    def syncBitboards(self):
+        self.pieceBitboards = {color+piece:0 for color in 'wb' for piece in 'PNBRQK'}
+        self.colorBitboards = {'w':0,'b':0}
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != '--':
+                    self.pieceBitboards[piece] |= squareBit(r,c)
+                    self.colorBitboards[piece[0]] |= squareBit(r,c)
+
+    def loadFen(self,fen):
+        super().loadFen(fen)
+        self.syncBitboards()
+
+    def restore(self,snapshot):
+        super().restore(snapshot)
+        self.syncBitboards()
+
+    def makeMove(self,move):
+        super().makeMove(move)
+        self.toggleMoveBits(move)
+
+    def undoMove(self):
+        if self.moveLog:
+            move = self.moveLog[-1]
+            super().undoMove()
+            self.toggleMoveBits(move)
+
+    '''
+    Flip the bits a move changes. XOR is its own inverse, so the same call makes and undoes a move.
+    '''
+    def toggleMoveBits(self,move):
+        pieceBitboards = self.pieceBitboards
+        colorBitboards = self.colorBitboards
+        color = move.piece_moved[0]
+        start = 1 << (move.start_row*8+move.start_col)
+        end = 1 << (move.end_row*8+move.end_col)
+        if move.isPawnPromotion:
+            pieceBitboards[move.piece_moved] ^= start
+            pieceBitboards[color+move.promotionChoice] ^= end
+        else:
+            pieceBitboards[move.piece_moved] ^= start | end
+        colorBitboards[color] ^= start | end
+
+        if move.piece_captured != '--':
+            captured = 1 << (move.start_row*8+move.end_col) if move.isEnPassantMove else end
+            pieceBitboards[move.piece_captured] ^= captured
+            colorBitboards[move.piece_captured[0]] ^= captured
+
+        if move.isCastleMove:
+            if move.end_col-move.start_col == 2: # kingside
+                rook = squareBit(move.end_row,7) | squareBit(move.end_row,5)
+            else: # queenside
+                rook = squareBit(move.end_row,0) | squareBit(move.end_row,3)
+            pieceBitboards[color+'R'] ^= rook
+            colorBitboards[color] ^= rook
+
+    '''
+    Determine if the opponent can attack the square r,c - looks up the attack tables from r,c outwards
+    '''
+    def isUnderAttack(self,r,c,ignore = ()):
+        enemyColor = 'b' if self.whiteToMove else 'w'
+        occupied = self.colorBitboards['w'] | self.colorBitboards['b']
+        if ignore:
+            occupied &= ~squareBit(*ignore)
+        return self.attackersTo(r*8+c,enemyColor,occupied) != 0
+
+    '''
+    All the opponent's pieces attacking the square r,c as a list of (row,col)
+    '''
+    def getAttackers(self,r,c,ignore = ()):
+        enemyColor = 'b' if self.whiteToMove else 'w'
+        occupied = self.colorBitboards['w'] | self.colorBitboards['b']
+        if ignore:
+            occupied &= ~squareBit(*ignore)
+        attackers = []
+        found = self.attackersTo(r*8+c,enemyColor,occupied)
+        while found:
+            bit = found & -found
+            found ^= bit
+            attackers.append(divmod(bit.bit_length()-1,8))
+        return attackers
+
+    '''
+    Bitboard of the pieces of the given colour that attack square sq
+    '''
+    def attackersTo(self,sq,color,occupied = None):
+        pieceBitboards = self.pieceBitboards
+        if occupied is None:
+            occupied = self.colorBitboards['w'] | self.colorBitboards['b']
+        friendlyColor = 'b' if color == 'w' else 'w'
+        queens = pieceBitboards[color+'Q']
+        return ((knightAttacks[sq] & pieceBitboards[color+'N'])
+                | (kingAttacks[sq] & pieceBitboards[color+'K'])
+                | (pawnAttacks[friendlyColor][sq] & pieceBitboards[color+'P'])
+                | (rookAttacks(sq,occupied) & (pieceBitboards[color+'R'] | queens))
+                | (bishopAttacks(sq,occupied) & (pieceBitboards[color+'B'] | queens)))
+
+    '''
+    Generate only legal moves: checkers and pinned pieces are found once from the attack tables
+    and every target set is masked with them, so nothing is played on the board.
+    genMode and fromSquare work as in GameState.getLegalMoves.
+    '''
+    def getLegalMoves(self,moves = None,genMode = chessEngine.allMoves,fromSquare = None):
+        if moves is None:
+            moves = []
+        else:
+            moves.clear()
+        color = 'w' if self.whiteToMove else 'b'
+        enemyColor = 'b' if self.whiteToMove else 'w'
+        pieceBitboards = self.pieceBitboards
+        own = self.colorBitboards[color]
+        enemy = self.colorBitboards[enemyColor]
+        occupied = own | enemy
+        board = self.board
+        Move = chessEngine.Move
+        movePool = Move.movePool
+        pieceCodes = Move.pieceCodes
+
+        kingBit = pieceBitboards[color+'K']
+        kingSq = kingBit.bit_length()-1
+        kingRow,kingCol = divmod(kingSq,8)
+        checkers = self.attackersTo(kingSq,enemyColor,occupied)
+        if genMode == chessEngine.tacticalMoves:
+            modeMask = enemy
+        elif genMode == chessEngine.quietMoves:
+            modeMask = ~occupied
+        else:
+            modeMask = allSquares
+        fromMask = allSquares if fromSquare is None else squareBit(*fromSquare)
+
+        # king moves - the king itself must not block the rays it is stepping away from
+        withoutKing = occupied ^ kingBit
+        targets = kingAttacks[kingSq] & ~own & modeMask if kingBit & fromMask else 0
+        while targets:
+            target = targets & -targets
+            targets ^= target
+            sq = target.bit_length()-1
+            if not self.attackersTo(sq,enemyColor,withoutKing):
+                endRow,endCol = divmod(sq,8)
+                moves.append(Move.fromSquares(kingRow,kingCol,endRow,endCol,color+'K',board[endRow][endCol]))
+        if checkers & (checkers-1): # double check - only the king can move
+            return moves
+
+        if checkers:
+            checkMask = between[kingSq][checkers.bit_length()-1] | checkers
+        else:
+            checkMask = allSquares
+            if kingBit & fromMask and genMode != chessEngine.tacticalMoves:
+                self.getCastleBitboardMoves(kingRow,kingCol,enemyColor,occupied,moves)
+
+        # a piece is pinned when it is the only piece between the king and an enemy slider
+        enemyRooks = pieceBitboards[enemyColor+'R'] | pieceBitboards[enemyColor+'Q']
+        enemyBishops = pieceBitboards[enemyColor+'B'] | pieceBitboards[enemyColor+'Q']
+        pinLines = {}
+        snipers = (rookAttacks(kingSq,0) & enemyRooks) | (bishopAttacks(kingSq,0) & enemyBishops)
+        while snipers:
+            sniper = snipers & -snipers
+            snipers ^= sniper
+            sniperSq = sniper.bit_length()-1
+            blockers = between[kingSq][sniperSq] & occupied
+            if blockers & own and not blockers & (blockers-1):
+                pinLines[blockers.bit_length()-1] = line[kingSq][sniperSq]
+
+        pieces = (own ^ kingBit) & fromMask
+        while pieces:
+            bit = pieces & -pieces
+            pieces ^= bit
+            sq = bit.bit_length()-1
+            r,c = divmod(sq,8)
+            piece = board[r][c][1]
+            pinLine = pinLines.get(sq,allSquares)
+            if piece == 'P':
+                step = -1 if color == 'w' else 1
+                startRank = rank2 if color == 'w' else rank7
+                isPromotion = r+step == 0 or r+step == 7
+                targets = squareBit(r+step,c) & ~occupied
+                if targets and bit & startRank:
+                    targets |= squareBit(r+2*step,c) & ~occupied
+                if genMode != chessEngine.allMoves and (genMode == chessEngine.tacticalMoves) != isPromotion:
+                    targets = 0 # a push is quiet unless it promotes
+                if genMode != chessEngine.quietMoves:
+                    targets |= pawnAttacks[color][sq] & enemy
+                targets &= checkMask & pinLine
+                if isPromotion:
+                    self.addPromotions(r,c,targets,color+'P',moves)
+                    targets = 0
+                elif self.enPassantPossible and genMode != chessEngine.quietMoves:
+                    epBit = squareBit(*self.enPassantPossible)
+                    if pawnAttacks[color][sq] & epBit & pinLine:
+                        captured = squareBit(r,self.enPassantPossible[1])
+                        afterCapture = (occupied ^ bit ^ captured) | epBit
+                        # the capture has to deal with a check, and lifting two pawns off a row must not expose the king
+                        if ((epBit | captured) & checkMask and not rookAttacks(kingSq,afterCapture) & enemyRooks
+                                and not bishopAttacks(kingSq,afterCapture) & enemyBishops):
+                            moves.append(Move.fromSquares(r,c,self.enPassantPossible[0],self.enPassantPossible[1],color+'P','--',isEnPassantMove = True))
+            else:
+                if piece == 'N':
+                    targets = knightAttacks[sq]
+                elif piece == 'B':
+                    targets = bishopAttacks(sq,occupied)
+                elif piece == 'R':
+                    targets = rookAttacks(sq,occupied)
+                else:
+                    targets = queenAttacks(sq,occupied)
+                targets &= ~own & checkMask & pinLine & modeMask
+            pieceMoved = color+piece
+            # look the moves up in Move.movePool directly - the same key Move.fromSquares builds,
+            # without a call per move; fromSquares only runs for a move never generated before
+            startKey = sq << 6
+            movedKey = pieceCodes[pieceMoved] << 4
+            while targets:
+                target = targets & -targets
+                targets ^= target
+                endSq = target.bit_length()-1
+                captured = board[endSq >> 3][endSq & 7]
+                move = movePool.get(((startKey | endSq) << 8 | movedKey | pieceCodes[captured]) << 5 | plainMoveKeyBits)
+                if move is None:
+                    move = Move.fromSquares(r,c,endSq >> 3,endSq & 7,pieceMoved,captured)
+                moves.append(move)
+        return moves
+
+    '''
+    A pawn reaching the last row can become a queen, knight, rook or bishop on each target square
+    '''
+    def addPromotions(self,r,c,targets,pawn,moves):
+        board = self.board
+        while targets:
+            target = targets & -targets
+            targets ^= target
+            endRow,endCol = divmod(target.bit_length()-1,8)
+            for promotion in ('Q','N','R','B'):
+                moves.append(chessEngine.Move.fromSquares(r,c,endRow,endCol,pawn,board[endRow][endCol],promotionChoice = promotion))
+
+    def getCastleBitboardMoves(self,r,c,enemyColor,occupied,moves):
+        if self.whiteToMove:
+            kingside,queenside = self.currentCastlingRights.wks,self.currentCastlingRights.wqs
+        else:
+            kingside,queenside = self.currentCastlingRights.bks,self.currentCastlingRights.bqs
+        if kingside and not (squareBit(r,c+1) | squareBit(r,c+2)) & occupied:
+            if not self.attackersTo(r*8+c+1,enemyColor,occupied) and not self.attackersTo(r*8+c+2,enemyColor,occupied):
+                moves.append(chessEngine.Move.fromSquares(r,c,r,c+2,self.board[r][c],'--',isCastleMove = True))
+        if queenside and not (squareBit(r,c-1) | squareBit(r,c-2) | squareBit(r,c-3)) & occupied:
+            if not self.attackersTo(r*8+c-1,enemyColor,occupied) and not self.attackersTo(r*8+c-2,enemyColor,occupied):
+                moves.append(chessEngine.Move.fromSquares(r,c,r,c-2,self.board[r][c],'--',isCastleMove = True))
+
+    '''
+    All valid moves without considering checks
+    '''
+    def getPossibleMoves(self):
+        moves = []
+        color = 'w' if self.whiteToMove else 'b'
+        enemyColor = 'b' if self.whiteToMove else 'w'
+        own = self.colorBitboards[color]
+        enemy = self.colorBitboards[enemyColor]
+        occupied = own | enemy
+        board = self.board
+
+        pieces = own
+        while pieces:
+            bit = pieces & -pieces
+            pieces ^= bit
+            sq = bit.bit_length()-1
+            r,c = divmod(sq,8)
+            piece = board[r][c][1]
+            if piece == 'P':
+                self.getPawnBitboardMoves(r,c,sq,color,enemy,occupied,moves)
+                continue
+            elif piece == 'N':
+                targets = knightAttacks[sq]
+            elif piece == 'B':
+                targets = bishopAttacks(sq,occupied)
+            elif piece == 'R':
+                targets = rookAttacks(sq,occupied)
+            elif piece == 'Q':
+                targets = queenAttacks(sq,occupied)
+            else:
+                targets = kingAttacks[sq]
+            targets &= ~own
+            pieceMoved = color+piece
+            while targets:
+                target = targets & -targets
+                targets ^= target
+                endRow,endCol = divmod(target.bit_length()-1,8)
+                moves.append(chessEngine.Move.fromSquares(r,c,endRow,endCol,pieceMoved,board[endRow][endCol]))
+        return moves
+
+    def getPawnBitboardMoves(self,r,c,sq,color,enemy,occupied,moves):
+        board = self.board
+        Move = chessEngine.Move
+        pawn = color+'P'
+        step = -1 if color == 'w' else 1
+        push = squareBit(r+step,c)
+        if r+step == 0 or r+step == 7:
+            self.addPromotions(r,c,(push & ~occupied) | (pawnAttacks[color][sq] & enemy),pawn,moves)
+            return
+        if not push & occupied:
+            moves.append(Move.fromSquares(r,c,r+step,c,pawn,'--'))
+            startRank = rank2 if color == 'w' else rank7
+            if squareBit(r,c) & startRank and not squareBit(r+2*step,c) & occupied:
+                moves.append(Move.fromSquares(r,c,r+2*step,c,pawn,'--'))
+
+        targets = pawnAttacks[color][sq] & enemy
+        while targets:
+            target = targets & -targets
+            targets ^= target
+            endRow,endCol = divmod(target.bit_length()-1,8)
+            moves.append(Move.fromSquares(r,c,endRow,endCol,pawn,board[endRow][endCol]))
+
+        if self.enPassantPossible:
+            if pawnAttacks[color][sq] & squareBit(*self.enPassantPossible):
+                moves.append(Move.fromSquares(r,c,self.enPassantPossible[0],self.enPassantPossible[1],pawn,'--',isEnPassantMove = True))
@@ -0,0 +1,206 @@
+"""
+Opening book - a sorted binary file of (position key, move, weight) records looked up in place.
+The file is memory mapped and binary searched, so opening a book costs nothing however big it is,
+and every process using the same book shares one copy of it in the page cache.
+
+Records use the Polyglot layout: 16 bytes, big-endian - key (8 bytes), move (2), weight (2),
+learn (4, unused) - sorted by key. Moves are encoded the Polyglot way too (to file, to rank,
+from file, from rank, promotion piece, 3 bits each; castling is written as the king taking its
+own rook). The keys are this engine's Zobrist keys rather than Polyglot's random numbers, so
+books are built with this module from PGN files rather than downloaded.
+
+Usage:
+    python chessBook.py build games.pgn book.bin [--max-ply 20] [--min-count 2]
+    python chessBook.py probe book.bin [--fen "<fen>"]
+"""
+
+import argparse
+import mmap
+import os
+import random
+import struct
+import sys
+
+import chessEngine
+import chessPgn
+
+recordFormat = struct.Struct('>QHHI')
+recordSize = recordFormat.size # 16
+keyFormat = struct.Struct('>Q')
+promotionPieces = {'':0,'N':1,'B':2,'R':3,'Q':4}
+
+
+'''
+Polyglot 16-bit move code of a Move. Rows count from rank 1 in the file, from rank 8 on self.board.
+'''
+def encodeMove(move):
+    endCol = move.end_col
+    if move.isCastleMove: # the king "takes" its own rook
+        endCol = 7 if move.end_col > move.start_col else 0
+    return (endCol | (7-move.end_row) << 3 | move.start_col << 6 | (7-move.start_row) << 9
+            | promotionPieces[move.promotionChoice] << 12)
+
+
+'''
+The legal move in legalMoves that a Polyglot move code stands for, or None
+'''
+def decodeMove(code,legalMoves):
+    endCol,endRow = code & 7,7-(code >> 3 & 7)
+    startCol,startRow = code >> 6 & 7,7-(code >> 9 & 7)
+    promotion = code >> 12 & 7
+    for move in legalMoves:
+        if move.start_row == startRow and move.start_col == startCol and promotionPieces[move.promotionChoice] == promotion:
+            if move.isCastleMove:
+                if endRow == move.end_row and endCol == (7 if move.end_col > move.start_col else 0):
+                    return move
+            elif move.end_row == endRow and move.end_col == endCol:
+                return move
+    return None
+
+
+class OpeningBook():
+    '''
+    Read-only view of a book file. Nothing is read up front; each lookup binary searches the mapped file.
+    '''
+
+    def __init__(self,path) -> None:
+        self.path = path
+        self.file = open(path,'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        if size % recordSize:
+            self.file.close()
+            raise ValueError("%s is not a book file - its size is not a multiple of %d bytes" % (path,recordSize))
+        self.count = size//recordSize
+        # an empty file cannot be mapped, and has nothing to look up anyway
+        self.data = mmap.mmap(self.file.fileno(),0,access = mmap.ACCESS_READ) if size else b''
+
+    def close(self):
+        if self.count:
+            self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    '''
+    (move code, weight) of every record for this key - the records of one key are next to each other
+    '''
+    def lookup(self,key):
+        data = self.data
+        low,high = 0,self.count
+        while low < high: # first record whose key is not below key
+            middle = (low+high)//2
+            if keyFormat.unpack_from(data,middle*recordSize)[0] < key:
+                low = middle+1
+            else:
+                high = middle
+        found = []
+        while low < self.count:
+            recordKey,code,weight,_ = recordFormat.unpack_from(data,low*recordSize)
+            if recordKey != key:
+                break
+            found.append((code,weight))
+            low += 1
+        return found
+
+    '''
+    [(Move, weight)] for the book moves that are legal in this position, heaviest first
+    '''
+    def getMoves(self,gamestate):
+        records = self.lookup(gamestate.zobristKey)
+        if not records:
+            return []
+        legalMoves = gamestate.getLegalMoves()
+        moves = []
+        for code,weight in records:
+            move = decodeMove(code,legalMoves)
+            if move is not None:
+                moves.append((move,weight))
+        moves.sort(key = lambda entry: entry[1],reverse = True)
+        return moves
+
+    '''
+    A book move for this position or None - picked at random in proportion to the weights,
+    or always the heaviest one when best is set
+    '''
+    def pickMove(self,gamestate,best = False,rng = random):
+        moves = self.getMoves(gamestate)
+        if not moves:
+            return None
+        total = sum(weight for _,weight in moves)
+        if best or total == 0:
+            return moves[0][0]
+        choice = rng.randrange(total)
+        for move,weight in moves:
+            choice -= weight
+            if choice < 0:
+                return move
+        return moves[-1][0]
+
+
+'''
+Write (key, move code, weight) records to a book file, sorted the way lookups expect
+'''
+def writeBook(path,records):
+    records = sorted(records,key = lambda record: (record[0],-record[2]))
+    with open(path,'wb') as f:
+        for key,code,weight in records:
+            f.write(recordFormat.pack(key,code,min(weight,0xFFFF),0))
+    return len(records)
+
+
+'''
+Count how often each move was played from each position in the first maxPly plies of the games
+in a PGN file and write those counts as a book. Moves seen fewer than minCount times are left out.
+'''
+def buildBookFromPgn(pgnSource,path,maxPly = 20,minCount = 1):
+    counts = {}
+    gamestate = chessEngine.GameState()
+    for game in chessPgn.readGames(pgnSource):
+        try:
+            gamestate.loadFen(game.startFen())
+            for san in game.moves[:maxPly]:
+                move = chessPgn.sanToMove(gamestate,san)
+                entry = (gamestate.zobristKey,encodeMove(move))
+                counts[entry] = counts.get(entry,0)+1
+                gamestate.makeMove(move)
+        except ValueError: # a broken game - keep what was read before the error
+            continue
+    return writeBook(path,[(key,code,count) for (key,code),count in counts.items() if count >= minCount])
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Build or query an opening book")
+    commands = parser.add_subparsers(dest = "command",required = True)
+    build = commands.add_parser("build",help = "make a book from the opening moves of PGN games")
+    build.add_argument("pgn")
+    build.add_argument("book")
+    build.add_argument("--max-ply",type = int,default = 20,help = "only use the first this many plies of each game")
+    build.add_argument("--min-count",type = int,default = 1,help = "leave out moves played fewer times than this")
+    probe = commands.add_parser("probe",help = "list the book moves of a position")
+    probe.add_argument("book")
+    probe.add_argument("--fen",default = chessEngine.startFen)
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        count = buildBookFromPgn(args.pgn,args.book,args.max_ply,args.min_count)
+        print("wrote %d records to %s" % (count,args.book))
+    else:
+        gamestate = chessEngine.GameState.from_fen(args.fen)
+        with OpeningBook(args.book) as book:
+            moves = book.getMoves(gamestate)
+            for move,weight in moves:
+                print("%-8s %d" % (move.getSanNotation(gamestate),weight))
+            if not moves:
+                print("position not in book")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
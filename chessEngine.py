@@ -5,9 +5,42 @@ Determining the valid moves.
 Keep a log of moves allowing undo of moves.
 """
 
+import collections
+import random
+import threading
+
+import chessEval
+import chessInstrument
+
+# Zobrist keys - one random 64-bit number per (piece, square), castling state, en-passant file and side to move.
+# A fixed seed keeps the keys identical between runs and processes, so stored keys stay valid.
+zobristRandom = random.Random(20231229)
+zobristPieces = {color+piece:[zobristRandom.getrandbits(64) for _ in range(64)] for color in 'wb' for piece in 'PNBRQK'}
+zobristCastling = [zobristRandom.getrandbits(64) for _ in range(16)] # indexed by CastlingRights.index()
+zobristEnPassant = [zobristRandom.getrandbits(64) for _ in range(8)] # indexed by file
+zobristBlackToMove = zobristRandom.getrandbits(64)
+
+startFen = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1" # the standard starting position
+
+'''
+Compact, immutable copy of a position - see GameState.snapshot. A tuple, so it pickles to a
+few hundred bytes with no engine objects inside.
+board - 64 bytes, Move.pieceCodes of squares a8..h1
+castling - CastlingRights.index(), enPassant - square (row*8+col) or -1
+history - Zobrist keys of the earlier positions, one per occurrence, for repetition detection
+'''
+class GameSnapshot(collections.namedtuple('GameSnapshot','board whiteToMove castling enPassant halfmoveClock fullmoveNumber history')):
+    __slots__ = ()
+
+# which moves getLegalMoves should produce - tactical moves are captures and promotions, quiet moves are the rest
+allMoves,tacticalMoves,quietMoves = 0,1,2
+
 class GameState():
     
-    def __init__(self) -> None:
+    '''
+    moveCache - optional MoveCache, which can be shared by any number of game states
+    '''
+    def __init__(self,moveCache = None) -> None:
         # The board is an 8x8 2d list with each element having 2 characters
         # First character represents the color of the piece - b for Black and w for White
         # Second character represents the piece - R for rook, N for Knight, B for Bishop and K for King
@@ -24,6 +57,10 @@ class GameState():
         ] #Note: a two pawns have been added for testing
         self.moveFunctions = {'P':self.getPawnMoves,'B':self.getBishopMoves,'K':self.getKingMoves,
                               'N':self.getNightMoves,'Q':self.getQueenMoves,'R':self.getRookMoves}
+        self.pieceMoves = [] # scratch buffer reused by getLegalMoves for one piece's moves at a time
+        self.moveCache = moveCache
+        self.instrumentation = None # set by enableInstrumentation
+        self.allSquares = tuple((r,c) for r in range(8) for c in range(8))
         self.whiteToMove = True
         self.moveLog = []
         self.whiteKingLocation = (7,4)
@@ -31,18 +68,349 @@ class GameState():
         self.checkMate = False
         self.staleMate = False
         self.enPassantPossible = () # coords for the square where en-passant capture lands the pawn
+        self.enPassantLog = [self.enPassantPossible] # to restore enPassantPossible on undo
         # handle castling rights
         self.currentCastlingRights = CastlingRights(True,True,True,True)
         # to keep track of castling rights considering undo of moves
         self.castleRightLog = [self.currentCastlingRights]
         self.castleRightLog = [CastlingRights(self.currentCastlingRights.wks,self.currentCastlingRights.wqs,
                                               self.currentCastlingRights.bks,self.currentCastlingRights.bqs)]
+        self.resetHistory()
 
-    
     '''
-    Makes a move (cannot castle/en-passant/promote a pawn)
+    Start counting calls to makeMove/undoMove/getLegalMoves/getPossibleMoves/isUnderAttack, Move
+    allocations and time per phase (see chessInstrument). Pass an Instrumentation to share one between
+    several game states. Returns the Instrumentation; nothing is measured, or costs anything, until this is called.
+    '''
+    def enableInstrumentation(self,instrumentation = None):
+        if self.instrumentation is not None:
+            self.instrumentation.detach(self)
+        self.instrumentation = instrumentation or chessInstrument.Instrumentation(Move.movePool)
+        self.instrumentation.attach(self)
+        return self.instrumentation
+
+    def disableInstrumentation(self):
+        if self.instrumentation is not None:
+            self.instrumentation.detach(self)
+            self.instrumentation = None
+
+    '''
+    The current position as an immutable GameSnapshot (the move log is not part of it)
+    '''
+    def snapshot(self):
+        pieceCodes = Move.pieceCodes
+        board = bytes([pieceCodes[piece] for row in self.board for piece in row])
+        current = self.zobristLog[-1]
+        history = tuple(key for key,count in self.positionCounts.items() for _ in range(count-(key == current)))
+        enPassant = self.enPassantPossible[0]*8+self.enPassantPossible[1] if self.enPassantPossible else -1
+        return GameSnapshot(board,self.whiteToMove,self.currentCastlingRights.index(),enPassant,
+                            self.halfmoveClock,self.fullmoveNumber,history)
+
+    '''
+    Set up the position of a snapshot. The move log starts empty from there, but repetitions
+    of positions from before the snapshot are still recognised.
+    '''
+    def restore(self,snapshot):
+        pieceNames = Move.pieceNames
+        packed = snapshot.board
+        self.board = [[pieceNames[code] for code in packed[r*8:r*8+8]] for r in range(8)]
+        self.whiteKingLocation = divmod(packed.index(Move.pieceCodes['wK']),8)
+        self.blackKingLocation = divmod(packed.index(Move.pieceCodes['bK']),8)
+        self.whiteToMove = snapshot.whiteToMove
+        self.enPassantPossible = divmod(snapshot.enPassant,8) if snapshot.enPassant >= 0 else ()
+        self.enPassantLog = [self.enPassantPossible]
+        castling = snapshot.castling
+        self.currentCastlingRights = CastlingRights(bool(castling & 1),bool(castling & 2),bool(castling & 4),bool(castling & 8))
+        self.castleRightLog = [CastlingRights(self.currentCastlingRights.wks,self.currentCastlingRights.wqs,
+                                              self.currentCastlingRights.bks,self.currentCastlingRights.bqs)]
+        self.moveLog = []
+        self.checkMate = False
+        self.staleMate = False
+        self.resetHistory(snapshot.halfmoveClock,snapshot.fullmoveNumber)
+        for key in snapshot.history:
+            self.positionCounts[key] = self.positionCounts.get(key,0)+1
+
+    '''
+    New game state (of the same class) set up from a snapshot
+    '''
+    @classmethod
+    def fromSnapshot(cls,snapshot):
+        gamestate = cls()
+        gamestate.restore(snapshot)
+        return gamestate
+
+    '''
+    Independent copy of the game state, move log and undo history included. The logs only hold
+    values that never change (moves, keys, tuples), so copying the lists is enough.
+    Instrumentation is not carried over; the move cache is shared.
+    '''
+    def clone(self):
+        cls = type(self)
+        other = cls.__new__(cls)
+        state = other.__dict__
+        for name,value in self.__dict__.items():
+            if type(value) is list or type(value) is dict:
+                value = value.copy()
+            state[name] = value
+        for name in chessInstrument.countedMethods: # wrappers bound to this game state
+            state.pop(name,None)
+        other.instrumentation = None
+        other.board = [row[:] for row in self.board]
+        other.pieceMoves = []
+        other.moveFunctions = {'P':other.getPawnMoves,'B':other.getBishopMoves,'K':other.getKingMoves,
+                               'N':other.getNightMoves,'Q':other.getQueenMoves,'R':other.getRookMoves}
+        rights = self.currentCastlingRights # changed in place by makeMove, unlike the copies in castleRightLog
+        other.currentCastlingRights = CastlingRights(rights.wks,rights.wqs,rights.bks,rights.bqs)
+        return other
+
+    '''
+    copy.copy and copy.deepcopy give a full clone, move log included - only pickling goes through
+    the snapshot (copy would otherwise use __reduce__ and drop the move log)
+    '''
+    def __copy__(self):
+        return self.clone()
+
+    def __deepcopy__(self,memo):
+        return self.clone()
+
+    '''
+    Pickle through the snapshot - small, and free of bound methods and caches. The unpickled
+    game state has the same position and repetition history but an empty move log.
+    '''
+    def __reduce__(self):
+        return (restoreGameState,(type(self),self.snapshot()))
+
+    '''
+    Start the hash history, the evaluation terms and the fifty-move counter from the current position
+    '''
+    def resetHistory(self,halfmoveClock = 0,fullmoveNumber = 1):
+        self.startFullmoveNumber = fullmoveNumber # move number of the position the move log starts from
+        self.startWhiteToMove = self.whiteToMove
+        self.zobristLog = [self.computeZobristKey()] # the key of every position in the game so far
+        self.positionCounts = {self.zobristLog[-1]:1} # how often each key has occurred, for repetitions
+        self.halfmoveClockLog = [halfmoveClock] # plies since the last capture or pawn move
+        self.evalLog = [self.computeEvaluationTerms()] # (material, midgame, endgame, phase) after every move
+
+    '''
+    64-bit Zobrist key of the current position, kept up to date by makeMove/undoMove
+    '''
+    @property
+    def zobristKey(self):
+        return self.zobristLog[-1]
+
+    @property
+    def halfmoveClock(self):
+        return self.halfmoveClockLog[-1]
+
+    '''
+    FEN fullmove number - starts at 1 and goes up after every black move
+    '''
+    @property
+    def fullmoveNumber(self):
+        return self.startFullmoveNumber+(len(self.moveLog)+(0 if self.startWhiteToMove else 1))//2
+
+    '''
+    Build the Zobrist key from scratch (makeMove and undoMove only update it)
+    '''
+    def computeZobristKey(self):
+        key = 0
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != '--':
+                    key ^= zobristPieces[piece][r*8+c]
+        key ^= zobristCastling[self.currentCastlingRights.index()]
+        key ^= self.getEnPassantHash()
+        if not self.whiteToMove:
+            key ^= zobristBlackToMove
+        return key
+
+    '''
+    The en-passant file only goes into the key when a pawn of the side to move can actually capture,
+    otherwise positions that differ in nothing else would never count as repeated
+    '''
+    def getEnPassantHash(self):
+        if not self.enPassantPossible:
+            return 0
+        r,c = self.enPassantPossible
+        pawnRow,pawn = (r+1,'wP') if self.whiteToMove else (r-1,'bP')
+        if (c-1 >= 0 and self.board[pawnRow][c-1] == pawn) or (c+1 <= 7 and self.board[pawnRow][c+1] == pawn):
+            return zobristEnPassant[c]
+        return 0
+
+    '''
+    Material balance, middlegame and endgame piece-square totals (white minus black) and game phase,
+    counted from scratch (makeMove and undoMove only update them)
+    '''
+    def computeEvaluationTerms(self):
+        material = midgame = endgame = phase = 0
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != '--':
+                    material += chessEval.signedPieceValues[piece]
+                    midgame += chessEval.midgameSquareValues[piece][r*8+c]
+                    endgame += chessEval.endgameSquareValues[piece][r*8+c]
+                    phase += chessEval.piecePhases[piece]
+        return (material,midgame,endgame,phase)
+
+    @property
+    def materialScore(self):
+        return self.evalLog[-1][0]
+
+    @property
+    def gamePhase(self):
+        return self.evalLog[-1][3]
+
+    '''
+    Static evaluation in centipawns from white's point of view - material plus the piece-square
+    totals blended by game phase. Read from the running totals, so it costs the same in every position.
+    '''
+    @property
+    def evaluation(self):
+        return chessEval.taperedScore(*self.evalLog[-1])
+
+    '''
+    Threefold repetition - the current position has occurred at least three times
+    '''
+    def isThreefoldRepetition(self):
+        return self.positionCounts.get(self.zobristLog[-1],0) >= 3
+
+    '''
+    Fifty-move rule - fifty moves by each side without a capture or a pawn move
+    '''
+    def isFiftyMoveRule(self):
+        return self.halfmoveClockLog[-1] >= 100
+
+    '''
+    Set up the position described by a FEN string
+    e.g. "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1" is the starting position.
+    The castling, en-passant and move counter fields may be left out. Raises ValueError for a
+    malformed FEN or a position the move generator cannot play from (a pawn on the first or last
+    rank, an en-passant square with no pawn that just moved past it, the side not to move in check,
+    negative move counters), in which case the current position is left as it was. Castling rights
+    whose king or rook is not on its starting square are dropped.
+    '''
+    def loadFen(self,fen):
+        fields = fen.split()
+        if len(fields) < 2:
+            raise ValueError("FEN needs at least the piece placement and the side to move: "+fen)
+        placement,side = fields[0],fields[1]
+        castling = fields[2] if len(fields) > 2 else '-'
+        enPassant = fields[3] if len(fields) > 3 else '-'
+        if side not in ('w','b'):
+            raise ValueError("FEN side to move must be w or b: "+side)
+        if castling != '-' and (not castling or set(castling)-set('KQkq')):
+            raise ValueError("FEN castling field is not valid: "+castling)
+        if enPassant != '-' and (len(enPassant) != 2 or enPassant[0] not in Move.filesToCols
+                                 or enPassant[1] != ('6' if side == 'w' else '3')):
+            raise ValueError("FEN en-passant square is not valid for the side to move: "+enPassant)
+        try:
+            halfmoveClock = int(fields[4]) if len(fields) > 4 else 0
+            fullmoveNumber = int(fields[5]) if len(fields) > 5 else 1
+        except ValueError:
+            raise ValueError("FEN move counters must be numbers: "+fen) from None
+        if halfmoveClock < 0 or fullmoveNumber < 0:
+            raise ValueError("FEN move counters cannot be negative: "+fen)
+        rows = placement.split('/')
+        if len(rows) != 8:
+            raise ValueError("FEN must describe 8 ranks: "+fen)
+        board = []
+        kings = {}
+        for r,rowText in enumerate(rows):
+            row = []
+            for ch in rowText:
+                if ch in '12345678':
+                    row.extend(["--"]*int(ch))
+                elif ch.upper() in 'PNBRQK':
+                    piece = ('w' if ch.isupper() else 'b')+ch.upper()
+                    if piece[1] == 'P' and r in (0,7):
+                        raise ValueError("FEN has a pawn on the first or last rank: "+fen)
+                    if piece[1] == 'K':
+                        if piece in kings:
+                            raise ValueError("FEN has more than one "+("white" if piece == 'wK' else "black")+" king: "+fen)
+                        kings[piece] = (r,len(row))
+                    row.append(piece)
+                else:
+                    raise ValueError("FEN has an unknown piece letter: "+ch)
+            if len(row) != 8:
+                raise ValueError("FEN rank does not have 8 squares: "+rowText)
+            board.append(row)
+        if len(kings) != 2:
+            raise ValueError("FEN needs one king of each colour: "+fen)
+        if enPassant != '-':
+            # the pawn that just moved two squares must be in front of the square, which must be empty
+            r,c = Move.ranksToRows[enPassant[1]],Move.filesToCols[enPassant[0]]
+            pushed = r+1 if side == 'w' else r-1
+            if board[r][c] != '--' or board[pushed][c] != ('b' if side == 'w' else 'w')+'P':
+                raise ValueError("FEN en-passant square has no pawn that just moved past it: "+enPassant)
+        # the side that just moved cannot have left its king in check
+        probe = object.__new__(GameState)
+        probe.board = board
+        if probe.scanAttackers(*kings['bK' if side == 'w' else 'wK'],side,(),None):
+            raise ValueError("FEN leaves the side not to move in check: "+fen)
+        # a castling right only counts while the king and that rook are on their starting squares
+        castling = ''.join(right for right,(row,rookCol) in (('K',(7,7)),('Q',(7,0)),('k',(0,7)),('q',(0,0)))
+                           if right in castling and board[row][4] == ('w' if right.isupper() else 'b')+'K'
+                           and board[row][rookCol] == ('w' if right.isupper() else 'b')+'R')
+
+        self.board = board
+        self.whiteKingLocation = kings['wK']
+        self.blackKingLocation = kings['bK']
+        self.whiteToMove = side == 'w'
+        self.enPassantPossible = () if enPassant == '-' else (Move.ranksToRows[enPassant[1]],Move.filesToCols[enPassant[0]])
+        self.enPassantLog = [self.enPassantPossible]
+        self.currentCastlingRights = CastlingRights('K' in castling,'Q' in castling,'k' in castling,'q' in castling)
+        self.castleRightLog = [CastlingRights(self.currentCastlingRights.wks,self.currentCastlingRights.wqs,
+                                              self.currentCastlingRights.bks,self.currentCastlingRights.bqs)]
+        self.moveLog = []
+        self.checkMate = False
+        self.staleMate = False
+        self.resetHistory(halfmoveClock,fullmoveNumber)
+
+    '''
+    New game state set up from a FEN string (works for subclasses too)
+    '''
+    @classmethod
+    def from_fen(cls,fen):
+        gamestate = cls()
+        gamestate.loadFen(fen)
+        return gamestate
+
+    '''
+    FEN string of the current position, including castling rights, the en-passant square
+    and both move counters
+    '''
+    def to_fen(self):
+        rows = []
+        for row in self.board:
+            text = ''
+            empty = 0
+            for piece in row:
+                if piece == '--':
+                    empty += 1
+                    continue
+                if empty:
+                    text += str(empty)
+                    empty = 0
+                text += piece[1] if piece[0] == 'w' else piece[1].lower()
+            if empty:
+                text += str(empty)
+            rows.append(text)
+        rights = self.currentCastlingRights
+        castling = ('K' if rights.wks else '')+('Q' if rights.wqs else '')+('k' if rights.bks else '')+('q' if rights.bqs else '')
+        if self.enPassantPossible:
+            enPassant = Move.colsToFiles[self.enPassantPossible[1]]+Move.rowsToRanks[self.enPassantPossible[0]]
+        else:
+            enPassant = '-'
+        return "%s %s %s %s %d %d" % ('/'.join(rows),'w' if self.whiteToMove else 'b',castling or '-',
+                                      enPassant,self.halfmoveClock,self.fullmoveNumber)
+
+    '''
+    Makes a move, including castling, en-passant and promotion, and updates the logs undoMove needs
     '''
     def makeMove(self,move):
+        oldHash = self.zobristLog[-1] ^ self.getEnPassantHash() ^ zobristCastling[self.currentCastlingRights.index()]
         self.board[move.start_row][move.start_col] = "--"
         self.board[move.end_row][move.end_col] = move.piece_moved
         self.moveLog.append(move)
@@ -53,9 +421,9 @@ class GameState():
         elif(move.piece_moved == "bK"):
             self.blackKingLocation = (move.end_row,move.end_col)
         
-        # promote to a Queen
+        # promote to the chosen piece (a Queen unless asked otherwise)
         if move.isPawnPromotion:
-            self.board[move.end_row][move.end_col] = move.piece_moved[0]+'Q'
+            self.board[move.end_row][move.end_col] = move.piece_moved[0]+move.promotionChoice
         
         # en-passant
         if move.isEnPassantMove:
@@ -66,27 +434,86 @@ class GameState():
             self.enPassantPossible = ((move.start_row+move.end_row)//2,move.end_col)
         else:
             self.enPassantPossible = () #reset is the pawn move did not lead to en-passant
+        self.enPassantLog.append(self.enPassantPossible)
 
         # castle
-            if move.isCastleMove:
-                if move.end_col-move.start_col == 2: # kingside castle
-                    self.board[move.end_row][move.end_col-1] = self.board[move.end_row][move.end_col+1] # move the rook
-                    self.board[move.end_row][move.end_col+1] = '--' #remove the rook
-                else: #queenside castle
-                    self.board[move.end_row][move.end_col+1] = self.board[move.end_row][move.end_col-2] # move the rook
-                    self.board[move.end_row][move.end_col-2] = '--'
+        if move.isCastleMove:
+            if move.end_col-move.start_col == 2: # kingside castle
+                self.board[move.end_row][move.end_col-1] = self.board[move.end_row][move.end_col+1] # move the rook
+                self.board[move.end_row][move.end_col+1] = '--' #remove the rook
+            else: #queenside castle
+                self.board[move.end_row][move.end_col+1] = self.board[move.end_row][move.end_col-2] # move the rook
+                self.board[move.end_row][move.end_col-2] = '--'
 
         # update castling rights (only when a rook or a king has moved)
         self.updateCastlingRights(move)
         self.castleRightLog.append(CastlingRights(self.currentCastlingRights.wks,self.currentCastlingRights.wqs,
                                               self.currentCastlingRights.bks,self.currentCastlingRights.bqs))
 
+        # update the Zobrist key - only the squares, rights and en-passant file this move changed
+        pieceKeys = zobristPieces[move.piece_moved]
+        key = oldHash ^ zobristBlackToMove ^ pieceKeys[move.start_row*8+move.start_col]
+        key ^= zobristPieces[self.board[move.end_row][move.end_col]][move.end_row*8+move.end_col]
+        if move.piece_captured != '--':
+            captureRow = move.start_row if move.isEnPassantMove else move.end_row
+            key ^= zobristPieces[move.piece_captured][captureRow*8+move.end_col]
+        if move.isCastleMove:
+            rookKeys = zobristPieces[move.piece_moved[0]+'R']
+            if move.end_col-move.start_col == 2: # kingside
+                key ^= rookKeys[move.end_row*8+7] ^ rookKeys[move.end_row*8+5]
+            else: # queenside
+                key ^= rookKeys[move.end_row*8] ^ rookKeys[move.end_row*8+3]
+        key ^= zobristCastling[self.currentCastlingRights.index()] ^ self.getEnPassantHash()
+        self.zobristLog.append(key)
+        self.positionCounts[key] = self.positionCounts.get(key,0)+1
+        if move.piece_moved[1] == 'P' or move.piece_captured != '--':
+            self.halfmoveClockLog.append(0)
+        else:
+            self.halfmoveClockLog.append(self.halfmoveClockLog[-1]+1)
+        self.updateEvaluation(move)
+
+    '''
+    Push the evaluation terms after move (already on the board) - only the squares it changed are looked at
+    '''
+    def updateEvaluation(self,move):
+        material,midgame,endgame,phase = self.evalLog[-1]
+        midgameValues = chessEval.midgameSquareValues
+        endgameValues = chessEval.endgameSquareValues
+        start = move.start_row*8+move.start_col
+        end = move.end_row*8+move.end_col
+        placed = self.board[move.end_row][move.end_col] # differs from piece_moved after a promotion
+        midgame += midgameValues[placed][end]-midgameValues[move.piece_moved][start]
+        endgame += endgameValues[placed][end]-endgameValues[move.piece_moved][start]
+        if move.isPawnPromotion:
+            material += chessEval.signedPieceValues[placed]-chessEval.signedPieceValues[move.piece_moved]
+            phase += chessEval.piecePhases[placed]
+        if move.piece_captured != '--':
+            captured = move.start_row*8+move.end_col if move.isEnPassantMove else end
+            material -= chessEval.signedPieceValues[move.piece_captured]
+            midgame -= midgameValues[move.piece_captured][captured]
+            endgame -= endgameValues[move.piece_captured][captured]
+            phase -= chessEval.piecePhases[move.piece_captured]
+        if move.isCastleMove:
+            rook = move.piece_moved[0]+'R'
+            row = move.end_row*8
+            rookFrom,rookTo = (row+7,row+5) if move.end_col-move.start_col == 2 else (row,row+3)
+            midgame += midgameValues[rook][rookTo]-midgameValues[rook][rookFrom]
+            endgame += endgameValues[rook][rookTo]-endgameValues[rook][rookFrom]
+        self.evalLog.append((material,midgame,endgame,phase))
+
     '''
     Undo the last move
     '''
     def undoMove(self):
         if self.moveLog:
             move = self.moveLog.pop()
+            key = self.zobristLog.pop()
+            if self.positionCounts[key] == 1:
+                del self.positionCounts[key]
+            else:
+                self.positionCounts[key] -= 1
+            self.halfmoveClockLog.pop()
+            self.evalLog.pop()
             self.board[move.start_row][move.start_col] = move.piece_moved
             self.board[move.end_row][move.end_col] = move.piece_captured # places empty if there was no piece captured
             self.whiteToMove = not self.whiteToMove # switch back to the player's move
@@ -100,14 +527,14 @@ class GameState():
             if move.isEnPassantMove:
                 self.board[move.end_row][move.end_col] = '--' # reset the landing square after en-passant
                 self.board[move.start_row][move.end_col] = move.piece_captured
-                self.enPassantPossible = (move.end_row,move.end_col)
-                # if we don't reset this, we won't be able to repeat en-passant after an undo
-            if move.piece_moved[1] == 'P' and abs(move.start_row-move.end_row) == 2:
-                self.enPassantPossible = ()
+            self.enPassantLog.pop()
+            self.enPassantPossible = self.enPassantLog[-1]
             
             # undo castling rights
             self.castleRightLog.pop() # pop the latest castle rights from the undone move
-            self.currentCastlingRights = self.castleRightLog[-1] # update castle rights to what they were 
+            # copy, so the next makeMove does not change the rights stored in the log
+            lastRights = self.castleRightLog[-1]
+            self.currentCastlingRights = CastlingRights(lastRights.wks,lastRights.wqs,lastRights.bks,lastRights.bqs)
             # undo castle move
             if move.isCastleMove:
                 if move.end_col-move.start_col == 2: #kingside
@@ -136,40 +563,62 @@ class GameState():
                     self.currentCastlingRights.bqs = False
                 elif move.start_col == 7: # black's king side rook
                     self.currentCastlingRights.bks = False
-    
+        # a rook captured on its starting square cannot castle either
+        if move.piece_captured == 'wR':
+            if move.end_row == 7:
+                if move.end_col == 0:
+                    self.currentCastlingRights.wqs = False
+                elif move.end_col == 7:
+                    self.currentCastlingRights.wks = False
+        elif move.piece_captured == 'bR':
+            if move.end_row == 0:
+                if move.end_col == 0:
+                    self.currentCastlingRights.bqs = False
+                elif move.end_col == 7:
+                    self.currentCastlingRights.bks = False
+
     '''
     All valid moves considering check
     '''
     def getValidMove(self):
-        print(self.currentCastlingRights.wks,self.currentCastlingRights.wqs,self.currentCastlingRights.bks,self.currentCastlingRights.bqs)
-        tempEnPassantPossible = self.enPassantPossible # copy of square where enpassant is possible
-        tempCastleRights = CastlingRights(self.currentCastlingRights.wks,self.currentCastlingRights.wqs,
-                                          self.currentCastlingRights.bks,self.currentCastlingRights.bqs)
-        #1. generate all possible moves
-        moves = self.getPossibleMoves()
-        if self.whiteToMove:
-            self.getCastleMoves(self.whiteKingLocation[0],self.whiteKingLocation[1],moves)
-        else:
-            self.getCastleMoves(self.blackKingLocation[0],self.blackKingLocation[1],moves)
-        #2. for each move -> make the move
-        for i in range(len(moves)-1,-1,-1):
-            self.makeMove(moves[i])
-            #3. generate opponent's possible moves
-            opponentMoves = self.getPossibleMoves()
-            #4. for all of opponent's possible moves -> see if the king is being attacked
-            self.whiteToMove = not self.whiteToMove
-            if self.isInCheck():
-                moves.remove(moves[i]) #5. Not a valid move if king is under attack
-            self.whiteToMove = not self.whiteToMove
-            self.undoMove()
+        moves = self.getCachedLegalMoves()
+        self.updateGameStatus(moves)
+        return moves
+
+    '''
+    Legal moves through the move cache when there is one. A cached result is a tuple shared with
+    every other game that reached the same position, so it must not be changed.
+    '''
+    def getCachedLegalMoves(self):
+        if self.moveCache is None:
+            return self.getLegalMoves()
+        key = self.getPositionKey()
+        moves = self.moveCache.get(key)
+        if moves is None:
+            moves = tuple(self.getLegalMoves())
+            self.moveCache.put(key,moves)
+        return moves
+
+    '''
+    Everything the legal moves depend on - the board, side to move, castling rights and an
+    en-passant square that can actually be used. Exact, unlike the Zobrist key.
+    '''
+    def getPositionKey(self):
+        return (''.join([''.join(row) for row in self.board]),self.whiteToMove,self.currentCastlingRights.index(),
+                self.enPassantPossible if self.getEnPassantHash() else ())
+
+    '''
+    Set checkMate/staleMate from the legal moves of the current position
+    (for callers that generated the moves elsewhere, e.g. on a worker thread).
+    Only the flags change - reporting the end of the game is up to the caller.
+    '''
+    def updateGameStatus(self,moves):
         if len(moves) == 0:
             if self.isInCheck():
                 self.checkMate = True
-                print("CHECKMATE")
-                print("BLACK" if self.whiteToMove else "WHITE","WON!")
-                quit()
+                self.staleMate = False
             else:
-                print("STALEMATE!")
+                self.checkMate = False
                 self.staleMate = True
         # if we make a move leading to either of the mates -> the values will become true
         # but if we undo after a checkmate/stalemate, we need to reset the values to False
@@ -177,10 +626,213 @@ class GameState():
             self.checkMate = False
             self.staleMate = False
 
-        self.enPassantPossible = tempEnPassantPossible
-        self.currentCastlingRights = tempCastleRights
+    '''
+    How the game stands: (status, result) with status one of 'ongoing', 'checkmate', 'stalemate',
+    'threefold' or 'fifty-move' and result in PGN form - '1-0', '0-1', '1/2-1/2' or '*'
+    '''
+    def getGameStatus(self,moves = None):
+        if moves is None:
+            moves = self.getLegalMoves()
+        if not moves:
+            if self.isInCheck():
+                return ('checkmate','0-1' if self.whiteToMove else '1-0')
+            return ('stalemate','1/2-1/2')
+        if self.isThreefoldRepetition():
+            return ('threefold','1/2-1/2')
+        if self.isFiftyMoveRule():
+            return ('fifty-move','1/2-1/2')
+        return ('ongoing','*')
+
+    '''
+    Generate only legal moves. Checks and pins are worked out once from the king,
+    so no move is played on the board to test it and the game state is left untouched.
+    moves - optional list to fill (it is cleared first), so a search can keep one buffer per ply
+    genMode - allMoves, tacticalMoves (captures and promotions) or quietMoves (everything else)
+    fromSquare - only generate the moves of the piece on this (row,col)
+    '''
+    def getLegalMoves(self,moves = None,genMode = allMoves,fromSquare = None):
+        if moves is None:
+            moves = []
+        else:
+            moves.clear()
+        if self.whiteToMove:
+            kingRow,kingCol = self.whiteKingLocation
+            allyColor = 'w'
+        else:
+            kingRow,kingCol = self.blackKingLocation
+            allyColor = 'b'
+        pins,checks = self.getPinsAndChecks()
+
+        # the king may go to any square the opponent does not attack once the king has left its square
+        pieceMoves = self.pieceMoves
+        if fromSquare is None or fromSquare == (kingRow,kingCol):
+            pieceMoves.clear()
+            self.getKingMoves(kingRow,kingCol,pieceMoves,genMode)
+            for move in pieceMoves:
+                if not self.isUnderAttack(move.end_row,move.end_col,ignore = (kingRow,kingCol)):
+                    moves.append(move)
+            if not checks and genMode != tacticalMoves:
+                self.getCastleMoves(kingRow,kingCol,moves)
+        if len(checks) > 1: # double check - only the king can move
+            return moves
+
+        validSquares = None # squares that capture the checking piece or block the check
+        if checks:
+            checkRow,checkCol,dr,dc = checks[0]
+            if self.board[checkRow][checkCol][1] in 'NP': # cannot be blocked
+                validSquares = {(checkRow,checkCol)}
+            else:
+                validSquares = set()
+                for i in range(1,8):
+                    square = (kingRow+dr*i,kingCol+dc*i)
+                    validSquares.add(square)
+                    if square == (checkRow,checkCol):
+                        break
+
+        squares = self.allSquares if fromSquare is None else (fromSquare,)
+        for r,c in squares:
+            piece = self.board[r][c]
+            if piece[0] != allyColor or piece[1] == 'K':
+                continue
+            pieceMoves.clear()
+            self.moveFunctions[piece[1]](r,c,pieceMoves,genMode)
+            pin = pins.get((r,c))
+            for move in pieceMoves:
+                if pin and (move.end_row-r)*pin[1] != (move.end_col-c)*pin[0]:
+                    continue # a pinned piece can only move along the pin
+                if validSquares is not None and (move.end_row,move.end_col) not in validSquares:
+                    # en-passant can still remove a pawn that gives check
+                    if not (move.isEnPassantMove and (move.start_row,move.end_col) in validSquares):
+                        continue
+                if move.isEnPassantMove and self.isEnPassantDiscoveredCheck(move,kingRow,kingCol):
+                    continue
+                moves.append(move)
         return moves
 
+    '''
+    Check a move that did not come from this position's generator, e.g. a hash or killer move
+    '''
+    def isLegalMove(self,move):
+        return self.findLegalMove(move) is not None
+
+    '''
+    The generator's own Move for move in this position, or None if it is not legal here.
+    Moves from other positions (killers, hash moves) compare equal to any move between the same
+    squares, so the piece has to match too, and only the returned object may be played.
+    '''
+    def findLegalMove(self,move):
+        piece = self.board[move.start_row][move.start_col]
+        if piece != move.piece_moved or piece[0] != ('w' if self.whiteToMove else 'b'):
+            return None
+        for legalMove in self.getLegalMoves(fromSquare = (move.start_row,move.start_col)):
+            if legalMove == move:
+                return legalMove
+        return None
+
+    '''
+    Yield the legal moves one stage at a time: the hash move, captures (most valuable victim first,
+    then least valuable attacker), promotions, killer moves and finally the other quiet moves.
+    A stage is only generated once the previous one is used up, so a consumer that stops early -
+    a beta cutoff on the first capture - never pays for the rest.
+    Any move made by the consumer must be undone before asking for the next one.
+    '''
+    def generateStagedMoves(self,hashMove = None,killers = ()):
+        if hashMove is not None:
+            hashMove = self.findLegalMove(hashMove)
+            if hashMove is not None:
+                yield hashMove
+
+        tactical = self.getLegalMoves(genMode = tacticalMoves)
+        captures = [move for move in tactical if move.piece_captured != '--']
+        captures.sort(key = captureOrder,reverse = True)
+        for move in captures:
+            if move != hashMove:
+                yield move
+        for move in tactical:
+            if move.piece_captured == '--' and move != hashMove: # promotions without a capture
+                yield move
+
+        quiets = self.getLegalMoves(genMode = quietMoves)
+        playedKillers = []
+        board = self.board
+        for killer in killers:
+            # a killer comes from another position - play the generated move, and only for the same piece
+            if (killer is None or killer == hashMove or killer in playedKillers
+                    or board[killer.start_row][killer.start_col] != killer.piece_moved or killer not in quiets):
+                continue
+            killer = quiets[quiets.index(killer)]
+            playedKillers.append(killer)
+            yield killer
+        for move in quiets:
+            if move != hashMove and move not in playedKillers:
+                yield move
+
+    '''
+    Walk outwards from the current player's king to find the pieces giving check and the pinned pieces.
+    Returns (pins,checks): pins maps a pinned piece's square to the direction of the pin,
+    checks lists (row,col,dr,dc) for each checking piece, direction measured from the king.
+    '''
+    def getPinsAndChecks(self):
+        pins = {}
+        checks = []
+        if self.whiteToMove:
+            allyColor,enemyColor = 'w','b'
+            kingRow,kingCol = self.whiteKingLocation
+        else:
+            allyColor,enemyColor = 'b','w'
+            kingRow,kingCol = self.blackKingLocation
+        pawnDirection = -1 if self.whiteToMove else 1 # rows towards the enemy pawns that can attack the king
+        directions = ((-1,0),(0,-1),(1,0),(0,1),(-1,-1),(-1,1),(1,-1),(1,1))
+        for j in range(8):
+            dr,dc = directions[j]
+            possiblePin = ()
+            for i in range(1,8):
+                endRow = kingRow + dr*i
+                endCol = kingCol + dc*i
+                if not (0 <= endRow < 8 and 0 <= endCol < 8):
+                    break
+                endPiece = self.board[endRow][endCol]
+                if endPiece == '--':
+                    continue
+                if endPiece[0] == allyColor:
+                    if possiblePin: # second allied piece - nothing behind it can pin or check
+                        break
+                    possiblePin = (endRow,endCol)
+                    continue
+                pieceType = endPiece[1]
+                if ((j < 4 and pieceType in 'RQ') or (j >= 4 and pieceType in 'BQ')
+                        or (i == 1 and pieceType == 'P' and dr == pawnDirection and dc != 0)):
+                    if possiblePin:
+                        pins[possiblePin] = (dr,dc)
+                    else:
+                        checks.append((endRow,endCol,dr,dc))
+                break
+        knightMoves = ((-2,-1),(-2,1),(-1,-2),(-1,2),(1,-2),(1,2),(2,-1),(2,1))
+        for m in knightMoves:
+            endRow = kingRow + m[0]
+            endCol = kingCol + m[1]
+            if 0 <= endRow < 8 and 0 <= endCol < 8 and self.board[endRow][endCol] == enemyColor+'N':
+                checks.append((endRow,endCol,m[0],m[1]))
+        return pins,checks
+
+    '''
+    En-passant takes two pawns off the same row at once, which can open that row
+    to an enemy rook or queen even though neither pawn was pinned on its own
+    '''
+    def isEnPassantDiscoveredCheck(self,move,kingRow,kingCol):
+        if kingRow != move.start_row:
+            return False
+        enemyColor = 'b' if self.whiteToMove else 'w'
+        step = 1 if move.end_col > kingCol else -1
+        col = kingCol + step
+        while 0 <= col < 8:
+            if col != move.start_col and col != move.end_col:
+                piece = self.board[kingRow][col]
+                if piece != '--':
+                    return piece[0] == enemyColor and piece[1] in 'RQ'
+            col += step
+        return False
+
     '''
     Determine if the current player is in check
     '''
@@ -191,22 +843,69 @@ class GameState():
             return self.isUnderAttack(self.blackKingLocation[0],self.blackKingLocation[1])
 
     '''
-    Determine if the opponenet can attack the square r,c 
+    Determine if the opponent can attack the square r,c
     (probably containing current player's king)
+    ignore is a square to treat as empty - the king's own square when testing where it may step
     '''
-    
-    def isUnderAttack(self,r,c):
-        self.whiteToMove = not self.whiteToMove #switch to opponent's perspective
-        opponentMoves = self.getPossibleMoves()
-        self.whiteToMove = not self.whiteToMove #switch back to current player
-
-        for move in opponentMoves:
-            if move.end_row == r and move.end_col == c:
-                return True
-        return False
+    def isUnderAttack(self,r,c,ignore = ()):
+        enemyColor = 'b' if self.whiteToMove else 'w'
+        return self.scanAttackers(r,c,enemyColor,ignore,None)
 
+    '''
+    All the opponent's pieces attacking the square r,c as a list of (row,col)
+    '''
+    def getAttackers(self,r,c,ignore = ()):
+        enemyColor = 'b' if self.whiteToMove else 'w'
+        attackers = []
+        self.scanAttackers(r,c,enemyColor,ignore,attackers)
+        return attackers
+
+    '''
+    Look outwards from r,c for pieces of the given color that attack it: knight jumps, pawn diagonals,
+    king neighbours and the first piece along each sliding ray.
+    Returns True at the first attacker, unless an attackers list is passed in to collect all of them.
+    '''
+    def scanAttackers(self,r,c,color,ignore,attackers):
+        board = self.board
+        ignoreRow,ignoreCol = ignore if ignore else (-1,-1)
+        knightMoves = ((-2,-1),(-2,1),(-1,-2),(-1,2),(1,-2),(1,2),(2,-1),(2,1))
+        for m in knightMoves:
+            endRow = r + m[0]
+            endCol = c + m[1]
+            if 0 <= endRow < 8 and 0 <= endCol < 8 and board[endRow][endCol] == color+'N':
+                if attackers is None:
+                    return True
+                attackers.append((endRow,endCol))
+
+        # pawns attack towards the other side, so look back the way they came
+        pawnRow = r+1 if color == 'w' else r-1
+        if 0 <= pawnRow < 8:
+            for dc in (-1,1):
+                endCol = c + dc
+                if 0 <= endCol < 8 and board[pawnRow][endCol] == color+'P':
+                    if attackers is None:
+                        return True
+                    attackers.append((pawnRow,endCol))
+
+        directions = ((-1,0),(0,-1),(1,0),(0,1),(-1,-1),(-1,1),(1,-1),(1,1))
+        for j in range(8):
+            dr,dc = directions[j]
+            sliders = 'RQ' if j < 4 else 'BQ'
+            for i in range(1,8):
+                endRow = r + dr*i
+                endCol = c + dc*i
+                if not (0 <= endRow < 8 and 0 <= endCol < 8):
+                    break
+                endPiece = board[endRow][endCol]
+                if endPiece == '--' or (endRow == ignoreRow and endCol == ignoreCol):
+                    continue
+                if endPiece[0] == color and (endPiece[1] in sliders or (i == 1 and endPiece[1] == 'K')):
+                    if attackers is None:
+                        return True
+                    attackers.append((endRow,endCol))
+                break
+        return False if attackers is None else len(attackers) > 0
 
-        
     '''
     All valid moves without considering checks
     '''
@@ -223,130 +922,113 @@ class GameState():
     '''
     Get all pawn moves for the pawn located at [r][c] and add them to the list
     '''
-    def getPawnMoves(self,r,c,moves):
-        # white Pawn moves
+    def getPawnMoves(self,r,c,moves,genMode = allMoves):
+        board = self.board
         if self.whiteToMove: #white's turn 
-            if self.board[r-1][c] == '--': # move one place
-                moves.append(Move((r,c),(r-1,c),self.board))
-                if r == 6 and self.board[r-2][c] == '--': # move two places
-                    moves.append(Move((r,c),(r-2,c),self.board))
-
-            # captures
-            if c-1 >= 0: #edge case - cannot capture beyond the extreme
-                if self.board[r-1][c-1][0] == 'b': #capture to the left
-                    moves.append(Move((r,c),(r-1,c-1),self.board))
-                elif (r-1,c-1) == self.enPassantPossible:
-                    moves.append(Move((r,c),(r-1,c-1),self.board,isEnPassantMove= True))
-            if c+1 <= 7: #capture to the right
-                if self.board[r-1][c+1][0] == 'b':
-                    moves.append(Move((r,c),(r-1,c-1),self.board))
-                elif (r-1,c+1) == self.enPassantPossible:
-                    moves.append(Move((r,c),(r-1,c+1),self.board,isEnPassantMove= True))
-
-        # black Pawn moves
+            pawn,enemyColor,step,startRow = 'wP','b',-1,6
         else:
-            if self.board[r+1][c] == '--': # move one place
-                moves.append(Move((r,c),(r+1,c),self.board))
-                if r == 1 and self.board[r+2][c] == '--': # move two places
-                    moves.append(Move((r,c),(r+2,c),self.board))
-            # captures
-            if c-1 >= 0: #edge case - cannot capture beyond the extreme
-                if self.board[r+1][c-1][0] == 'w': #capture to the left
-                    moves.append(Move((r,c),(r+1,c-1),self.board))
-                elif (r+1,c+1) == self.enPassantPossible:
-                    moves.append(Move((r,c),(r+1,c-1),self.board,isEnPassantMove= True))
-            if c+1 <= 7: #capture to the right
-                if self.board[r+1][c+1][0] == 'w':
-                    moves.append(Move((r,c),(r+1,c+1),self.board))
-                elif (r+1,c+1) == self.enPassantPossible:
-                    moves.append(Move((r,c),(r+1,c+1),self.board,isEnPassantMove= True))
+            pawn,enemyColor,step,startRow = 'bP','w',1,1
+        endRow = r+step
+        isPromotion = endRow == 0 or endRow == 7
+        promotions = ('Q','N','R','B') if isPromotion else ('Q',)
+        # a push is quiet unless it promotes, a capture is always tactical
+        if board[endRow][c] == '--' and (genMode == allMoves or (genMode == tacticalMoves) == isPromotion): # move one place
+            for promotion in promotions:
+                moves.append(Move.fromSquares(r,c,endRow,c,pawn,'--',promotionChoice = promotion))
+            if r == startRow and board[r+2*step][c] == '--': # move two places
+                moves.append(Move.fromSquares(r,c,r+2*step,c,pawn,'--'))
+        if genMode == quietMoves:
+            return
+
+        # captures
+        for dc in (-1,1): # capture to the left, then to the right
+            endCol = c+dc
+            if 0 <= endCol < 8: #edge case - cannot capture beyond the extreme
+                endPiece = board[endRow][endCol]
+                if endPiece[0] == enemyColor:
+                    for promotion in promotions:
+                        moves.append(Move.fromSquares(r,c,endRow,endCol,pawn,endPiece,promotionChoice = promotion))
+                elif (endRow,endCol) == self.enPassantPossible:
+                    moves.append(Move.fromSquares(r,c,endRow,endCol,pawn,endPiece,isEnPassantMove = True))
+
     '''
     Get all rook moves for the rook located at [r][c] and add them to the list
     '''
-    def getRookMoves(self,r,c,moves):
+    def getRookMoves(self,r,c,moves,genMode = allMoves):
         directions = ((-1,0),(0,-1),(0,1),(1,0))
-        enemyColor = "b" if self.whiteToMove else "w"
-
-        for d in directions:
-            for i in range(1,8):
-                endRow = r + d[0]*i
-                endCol = c + d[1]*i
-                if 0 <= endRow < 8 and 0 <= endCol < 8:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece == '--':
-                        moves.append(Move((r,c,moves),(endRow,endCol,moves),self.board))
-                    elif endPiece[0] == enemyColor:
-                        moves.append(Move((r,c,moves),(endRow,endCol,moves),self.board))
-                        break
-                    else:
-                        break
-                else:
-                    break
-
+        self.getSlidingMoves(r,c,directions,moves,genMode)
 
     '''
     Get all bishop moves for the bishop located at [r][c] and add them to the list
     '''
-    def getBishopMoves(self,r,c,moves):
+    def getBishopMoves(self,r,c,moves,genMode = allMoves):
         directions = ((-1,-1),(-1,1),(1,-1),(1,1))
+        self.getSlidingMoves(r,c,directions,moves,genMode)
+
+    '''
+    Moves of a rook, bishop or queen along the given directions, up to and including the first enemy piece
+    '''
+    def getSlidingMoves(self,r,c,directions,moves,genMode = allMoves):
+        board = self.board
+        piece = board[r][c]
         enemyColor = "b" if self.whiteToMove else "w"
 
         for d in directions:
             for i in range(1,8):
-                endRow = r+d[0]*i
-                endCol = c+d[1]*i
+                endRow = r + d[0]*i
+                endCol = c + d[1]*i
                 if 0 <= endRow < 8 and 0 <= endCol < 8:
-                    endPiece = self.board[endRow][endCol]
+                    endPiece = board[endRow][endCol]
                     if endPiece == '--':
-                        moves.append(Move((r,c),(endRow,endCol),self.board))
+                        if genMode != tacticalMoves:
+                            moves.append(Move.fromSquares(r,c,endRow,endCol,piece,endPiece))
                     elif endPiece[0] == enemyColor:
-                        moves.append(Move((r,c),(endRow,endCol),self.board))
+                        if genMode != quietMoves:
+                            moves.append(Move.fromSquares(r,c,endRow,endCol,piece,endPiece))
                         break
                     else:
                         break
                 else:
                     break
 
-
-    
     '''
     Get all night moves for the night located at [r][c] and add them to the list
     '''
-    def getNightMoves(self,r,c,moves):
+    def getNightMoves(self,r,c,moves,genMode = allMoves):
         knightMoves = ((-2,-1),(-2,1),(-1,-2),(-1,2),(1,-2),(1,2),(2,-1),(2,1))
-        playerColor = "w" if self.whiteToMove else "b"
-
-        for m in knightMoves:
-            endRow = r + m[0]
-            endCol = c + m[1]
-            if 0 <= endRow < 8 and 0 <= endCol < 8:
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0] != playerColor:
-                    moves.append(Move((r,c,moves),(endRow,endCol,moves),self.board))
+        self.getStepMoves(r,c,knightMoves,moves,genMode)
 
     '''
     Get all queen moves for the queen located at [r][c] and add them to the list
     '''
-    def getQueenMoves(self,r,c,moves):
-        self.getRookMoves(r,c,moves)
-        self.getBishopMoves(r,c,moves)
+    def getQueenMoves(self,r,c,moves,genMode = allMoves):
+        directions = ((-1,0),(0,-1),(0,1),(1,0),(-1,-1),(-1,1),(1,-1),(1,1))
+        self.getSlidingMoves(r,c,directions,moves,genMode)
 
     '''
     Get all king moves for the king located at [r][c] and add them to the list
     '''
-    def getKingMoves(self,r,c,moves):
+    def getKingMoves(self,r,c,moves,genMode = allMoves):
         directions = ((-1,-1),(-1,0),(-1,1),
                       (0,-1),(0,1),
                       (1,-1),(1,0),(1,1))
-        playerColor = "w" if self.whiteToMove else "b"
-        for i in range(1,8):
-            endRow = r + directions[i][0]
-            endCol = c + directions[i][1]
+        self.getStepMoves(r,c,directions,moves,genMode)
 
+    '''
+    Moves of a knight or king - single steps to any square not holding a piece of our own
+    '''
+    def getStepMoves(self,r,c,offsets,moves,genMode = allMoves):
+        board = self.board
+        piece = board[r][c]
+        playerColor = piece[0]
+        for m in offsets:
+            endRow = r + m[0]
+            endCol = c + m[1]
             if 0 <= endRow < 8 and 0 <= endCol < 8:
-                endPiece = self.board[endRow][endCol]
+                endPiece = board[endRow][endCol]
                 if endPiece[0] != playerColor:
-                    moves.append(Move((r,c,moves),(endRow,endCol,moves),self.board))
+                    if genMode == allMoves or (genMode == tacticalMoves) == (endPiece != '--'):
+                        moves.append(Move.fromSquares(r,c,endRow,endCol,piece,endPiece))
 
     '''
     Generate all valid castling moves for the king
@@ -362,13 +1044,73 @@ class GameState():
     def getKingsideCastleMoves(self,r,c,moves):
         if self.board[r][c+1] == '--' and self.board[r][c+2] == '--':
             if not self.isUnderAttack(r,c+1) and not self.isUnderAttack(r,c+2):
-                moves.append(Move((r,c),(r,c+2),self.board,isCastleMove = True))
+                moves.append(Move.fromSquares(r,c,r,c+2,self.board[r][c],'--',isCastleMove = True))
 
 
     def getQueensideCastleMoves(self,r,c,moves):
         if self.board[r][c-1] == '--' and self.board[r][c-2] == '--' and self.board[r][c-3] == '--':
             if not self.isUnderAttack(r,c-1) and not self.isUnderAttack(r,c-2):
-                moves.append(Move((r,c),(r,c-2),self.board,isCastleMove = True))
+                moves.append(Move.fromSquares(r,c,r,c-2,self.board[r][c],'--',isCastleMove = True))
+
+'''
+Sort key for captures - most valuable victim first, least valuable attacker among equal victims
+'''
+def captureOrder(move):
+    return 10*chessEval.pieceValues[move.piece_captured[1]]-chessEval.pieceValues[move.piece_moved[1]]
+
+'''
+Unpickling helper for GameState.__reduce__ - module level so pickle can find it by name
+'''
+def restoreGameState(cls,snapshot):
+    return cls.fromSnapshot(snapshot)
+
+class MoveCache():
+    '''
+    Bounded least-recently-used map from GameState.getPositionKey() to the legal moves of that position.
+    Safe to share between threads.
+    '''
+
+    def __init__(self,maxSize = 4096) -> None:
+        if maxSize < 1:
+            raise ValueError("move cache size must be at least 1")
+        self.maxSize = maxSize
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self,key):
+        with self.lock:
+            moves = self.entries.get(key)
+            if moves is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+            return moves
+
+    def put(self,key,moves):
+        with self.lock:
+            self.entries[key] = moves
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.maxSize:
+                self.entries.popitem(last = False) # the least recently used position
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    '''
+    Hit/miss counts and the hit rate, e.g. for logging
+    '''
+    def stats(self):
+        lookups = self.hits+self.misses
+        return {"size":len(self.entries),"maxSize":self.maxSize,"hits":self.hits,"misses":self.misses,
+                "hitRate":self.hits/lookups if lookups else 0.0}
 
 class CastlingRights():
     def __init__(self,wks,wqs,bks,bqs) -> None:
@@ -377,7 +1119,16 @@ class CastlingRights():
         self.wqs = wqs
         self.bqs = bqs
 
+    '''
+    The four rights packed into a number from 0 to 15
+    '''
+    def index(self):
+        return self.wks | self.wqs << 1 | self.bks << 2 | self.bqs << 3
+
 class Move():
+    # slots instead of a per-instance dict - move logs and search stacks keep a lot of these alive
+    __slots__ = ('start_row','start_col','end_row','end_col','piece_moved','piece_captured',
+                 'isPawnPromotion','isEnPassantMove','isCastleMove','promotionChoice','moveId')
 
     # map keys (ranks/files) to values (rows/cols)
 
@@ -388,27 +1139,59 @@ class Move():
                    "e":4,"f":5,"g":6,"h":7}
     colsToFiles = {v:k for k,v in filesToCols.items()}
 
-    def __init__(self,start_square,end_square,board, isEnPassantMove = False, isCastleMove = False):
+    pieceCodes = {"--":0,"wP":1,"wN":2,"wB":3,"wR":4,"wQ":5,"wK":6,
+                  "bP":7,"bN":8,"bB":9,"bR":10,"bQ":11,"bK":12}
+    pieceNames = tuple(sorted(pieceCodes,key = pieceCodes.get)) # piece code -> piece
+    promotionCodes = {"":0,"N":1,"B":2,"R":3,"Q":4}
+    # every distinct move ever generated, keyed by its full encoding - moves never change once made,
+    # so the generators hand out the same object each time instead of allocating a new one
+    movePool = {}
+
+    def __init__(self,start_square,end_square,board, isEnPassantMove = False, isCastleMove = False, promotionChoice = 'Q'):
+        self.setUp(start_square[0],start_square[1],end_square[0],end_square[1],
+                   board[start_square[0]][start_square[1]],board[end_square[0]][end_square[1]],
+                   isEnPassantMove,isCastleMove,promotionChoice)
 
-        self.start_row = start_square[0]
-        self.start_col = start_square[1]
-        self.end_row = end_square[0]
-        self.end_col = end_square[1]
-        self.piece_moved = board[self.start_row][self.start_col]
-        self.piece_captured = board[self.end_row][self.end_col]
+    """
+    Get the shared Move for these squares and pieces, creating it the first time it is asked for
+    """
+    @classmethod
+    def fromSquares(cls,start_row,start_col,end_row,end_col,piece_moved,piece_captured,
+                    isEnPassantMove = False, isCastleMove = False, promotionChoice = 'Q'):
+        pieceCodes = cls.pieceCodes
+        key = (((start_row*8+start_col) << 6 | (end_row*8+end_col)) << 8
+               | pieceCodes[piece_moved] << 4 | pieceCodes[piece_captured])
+        key = key << 5 | cls.promotionCodes[promotionChoice] << 2 | isCastleMove << 1 | isEnPassantMove
+        move = cls.movePool.get(key)
+        if move is None:
+            move = cls.__new__(cls)
+            move.setUp(start_row,start_col,end_row,end_col,piece_moved,piece_captured,
+                       isEnPassantMove,isCastleMove,promotionChoice)
+            cls.movePool[key] = move
+        return move
+
+    def setUp(self,start_row,start_col,end_row,end_col,piece_moved,piece_captured,isEnPassantMove,isCastleMove,promotionChoice):
+        self.start_row = start_row
+        self.start_col = start_col
+        self.end_row = end_row
+        self.end_col = end_col
+        self.piece_moved = piece_moved
+        self.piece_captured = piece_captured
         
         # check if the move leads to pawn promotion
-        self.isPawnPromotion = ((self.piece_moved == "wP" and self.end_row == 0) or (self.piece_moved == "bP" and self.end_row == 7))
+        self.isPawnPromotion = ((piece_moved == "wP" and end_row == 0) or (piece_moved == "bP" and end_row == 7))
+        self.promotionChoice = promotionChoice if self.isPawnPromotion else ""
 
         # check for en passant move
         self.isEnPassantMove = isEnPassantMove
         if self.isEnPassantMove:
-            self.piece_captured = "wP" if self.piece_moved == "bP" else "bP"
+            self.piece_captured = "wP" if piece_moved == "bP" else "bP"
 
         # check for castle move
         self.isCastleMove = isCastleMove
 
-        self.moveId = self.start_row*1000 + self.start_col*100 + self.end_row*10 + self.end_col
+        # start square in bits 0-5, end square in bits 6-11, promotion piece in bits 12-14
+        self.moveId = (start_row*8+start_col) | (end_row*8+end_col) << 6 | self.promotionCodes[self.promotionChoice] << 12
 
     """
     Override the equals method
@@ -418,8 +1201,56 @@ class Move():
             return self.moveId == other.moveId
         return False
 
+    def __hash__(self):
+        return self.moveId
+
+    '''
+    Long algebraic notation, e.g. e2e4 or e7e8q (the form UCI uses)
+    '''
     def getChessNotation(self):
-        return self.getRankFile(self.start_row,self.start_col)+self.getRankFile(self.end_row,self.end_col)
+        return (self.getRankFile(self.start_row,self.start_col)+self.getRankFile(self.end_row,self.end_col)
+                +self.promotionChoice.lower())
+
+    '''
+    Standard algebraic notation, e.g. Nbd7, exd5, O-O, e8=Q+ - what PGN files use.
+    gamestate must be at the position before the move; legalMoves can be passed in when the caller
+    already has them, they are only used to tell apart two pieces that can reach the same square.
+    '''
+    def getSanNotation(self,gamestate,legalMoves = None):
+        if self.isCastleMove:
+            san = "O-O" if self.end_col > self.start_col else "O-O-O"
+        else:
+            piece = self.piece_moved[1]
+            target = self.getRankFile(self.end_row,self.end_col)
+            capture = self.piece_captured != '--'
+            if piece == 'P':
+                san = (self.colsToFiles[self.start_col]+'x' if capture else '')+target
+                if self.isPawnPromotion:
+                    san += '='+self.promotionChoice
+            else:
+                if legalMoves is None:
+                    legalMoves = gamestate.getLegalMoves()
+                sameFile = sameRank = ambiguous = False
+                for other in legalMoves:
+                    if (other.piece_moved == self.piece_moved and other.end_row == self.end_row and other.end_col == self.end_col
+                            and (other.start_row != self.start_row or other.start_col != self.start_col)):
+                        ambiguous = True
+                        sameFile |= other.start_col == self.start_col
+                        sameRank |= other.start_row == self.start_row
+                if not ambiguous:
+                    origin = ''
+                elif not sameFile:
+                    origin = self.colsToFiles[self.start_col]
+                elif not sameRank:
+                    origin = self.rowsToRanks[self.start_row]
+                else:
+                    origin = self.getRankFile(self.start_row,self.start_col)
+                san = piece+origin+('x' if capture else '')+target
+        gamestate.makeMove(self)
+        if gamestate.isInCheck():
+            san += '#' if not gamestate.getLegalMoves() else '+'
+        gamestate.undoMove()
+        return san
 
     def getRankFile(self,r,c):
         return self.colsToFiles[c]+self.rowsToRanks[r]
@@ -0,0 +1,138 @@
+"""
+EPD (Extended Position Description) reading and writing.
+An EPD line is the first four FEN fields followed by semicolon-terminated operations, e.g.
+    r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - bm Bb5; id "ruy lopez";
+Files are read one line at a time, so a file of any size can be worked through in constant memory.
+Files ending in .gz are decompressed on the fly.
+
+Usage:
+    for fen,operations in readEpd("positions.epd"): ...
+    for gamestate,operations in iterPositions("positions.epd"): ...   # one GameState, reloaded per line
+"""
+
+import gzip
+
+import chessEngine
+
+
+'''
+Split the operations part of an EPD line into {opcode: [operands]}.
+Operands in double quotes may contain spaces and semicolons.
+'''
+def parseOperations(text):
+    operations = {}
+    i = 0
+    while i < len(text):
+        while i < len(text) and text[i] in ' \t;':
+            i += 1
+        if i >= len(text):
+            break
+        tokens = []
+        while i < len(text) and text[i] != ';':
+            if text[i] in ' \t':
+                i += 1
+            elif text[i] == '"':
+                end = text.find('"',i+1)
+                if end == -1:
+                    raise ValueError("unterminated string in EPD operations: "+text)
+                tokens.append(text[i+1:end])
+                i = end+1
+            else:
+                end = i
+                while end < len(text) and text[end] not in ' \t;"':
+                    end += 1
+                tokens.append(text[i:end])
+                i = end
+        operations[tokens[0]] = tokens[1:]
+    return operations
+
+
+'''
+Turn one EPD line into a full FEN and its operations. The hmvc and fmvn operations,
+when present, become the FEN move counters.
+'''
+def parseEpdLine(line):
+    fields = line.split(None,4)
+    if len(fields) < 4:
+        raise ValueError("EPD line needs four position fields: "+line)
+    operations = parseOperations(fields[4]) if len(fields) > 4 else {}
+    halfmoveClock = operations.get('hmvc',['0'])[0]
+    fullmoveNumber = operations.get('fmvn',['1'])[0]
+    return ' '.join(fields[:4]+[halfmoveClock,fullmoveNumber]),operations
+
+
+def openText(path):
+    if path.endswith('.gz'):
+        return gzip.open(path,'rt',encoding = 'utf-8',errors = 'replace')
+    return open(path,encoding = 'utf-8',errors = 'replace')
+
+
+'''
+Yield (fen, operations) for every position in an EPD file, lazily.
+source - a path, or any iterable of lines such as an open file or sys.stdin.
+Blank lines and lines starting with # are skipped. A malformed line raises ValueError
+with the line number unless skipInvalid is set, in which case it is passed over.
+'''
+def readEpd(source,skipInvalid = False):
+    if isinstance(source,str):
+        with openText(source) as lines:
+            yield from readEpd(lines,skipInvalid)
+        return
+    for number,line in enumerate(source,1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            yield parseEpdLine(line)
+        except ValueError as error:
+            if not skipInvalid:
+                raise ValueError("line %d: %s" % (number,error)) from None
+
+
+'''
+Yield (gamestate, operations) for every position in an EPD file. The same game state is loaded
+with each position in turn instead of building a new one per line, so keep to_fen() rather than
+the object if a position is needed after the loop moves on.
+'''
+def iterPositions(source,gamestate = None,skipInvalid = False):
+    if gamestate is None:
+        gamestate = chessEngine.GameState()
+    for fen,operations in readEpd(source,skipInvalid):
+        try:
+            gamestate.loadFen(fen)
+        except ValueError:
+            if skipInvalid:
+                continue
+            raise
+        yield gamestate,operations
+
+
+'''
+EPD line for the current position of a game state, with operations given as {opcode: operand(s)}
+'''
+def formatEpd(gamestate,operations = None):
+    text = ' '.join(gamestate.to_fen().split()[:4])
+    for opcode,operands in (operations or {}).items():
+        if isinstance(operands,(str,int)):
+            operands = [operands]
+        parts = [opcode]
+        for operand in operands:
+            operand = str(operand)
+            parts.append('"%s"' % operand if not operand or ' ' in operand or ';' in operand else operand)
+        text += ' '+' '.join(parts)+';'
+    return text
+
+
+'''
+Write (gamestate or fen, operations) pairs to an EPD file one line at a time
+'''
+def writeEpd(path,positions):
+    gamestate = None
+    with open(path,'w',encoding = 'utf-8') as f:
+        for position,operations in positions:
+            if isinstance(position,str):
+                if gamestate is None:
+                    gamestate = chessEngine.GameState()
+                gamestate.loadFen(position)
+                position = gamestate
+            f.write(formatEpd(position,operations)+'\n')
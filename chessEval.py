@@ -0,0 +1,109 @@
+"""
+Evaluation tables: piece values, piece-square tables and game phase weights.
+GameState keeps the totals up to date move by move; this module only holds the numbers.
+Tables are written from white's point of view with row 0 (rank 8) first, like self.board.
+"""
+
+pieceValues = {'P':100,'N':320,'B':330,'R':500,'Q':900,'K':0}
+
+# how much each piece counts towards the middlegame - 24 with all pieces on the board, 0 with only kings and pawns
+phaseWeights = {'P':0,'N':1,'B':1,'R':2,'Q':4,'K':0}
+maxPhase = 24
+
+pawnTable = [
+     0,  0,  0,  0,  0,  0,  0,  0,
+    50, 50, 50, 50, 50, 50, 50, 50,
+    10, 10, 20, 30, 30, 20, 10, 10,
+     5,  5, 10, 25, 25, 10,  5,  5,
+     0,  0,  0, 20, 20,  0,  0,  0,
+     5, -5,-10,  0,  0,-10, -5,  5,
+     5, 10, 10,-20,-20, 10, 10,  5,
+     0,  0,  0,  0,  0,  0,  0,  0]
+
+knightTable = [
+   -50,-40,-30,-30,-30,-30,-40,-50,
+   -40,-20,  0,  0,  0,  0,-20,-40,
+   -30,  0, 10, 15, 15, 10,  0,-30,
+   -30,  5, 15, 20, 20, 15,  5,-30,
+   -30,  0, 15, 20, 20, 15,  0,-30,
+   -30,  5, 10, 15, 15, 10,  5,-30,
+   -40,-20,  0,  5,  5,  0,-20,-40,
+   -50,-40,-30,-30,-30,-30,-40,-50]
+
+bishopTable = [
+   -20,-10,-10,-10,-10,-10,-10,-20,
+   -10,  0,  0,  0,  0,  0,  0,-10,
+   -10,  0,  5, 10, 10,  5,  0,-10,
+   -10,  5,  5, 10, 10,  5,  5,-10,
+   -10,  0, 10, 10, 10, 10,  0,-10,
+   -10, 10, 10, 10, 10, 10, 10,-10,
+   -10,  5,  0,  0,  0,  0,  5,-10,
+   -20,-10,-10,-10,-10,-10,-10,-20]
+
+rookTable = [
+     0,  0,  0,  0,  0,  0,  0,  0,
+     5, 10, 10, 10, 10, 10, 10,  5,
+    -5,  0,  0,  0,  0,  0,  0, -5,
+    -5,  0,  0,  0,  0,  0,  0, -5,
+    -5,  0,  0,  0,  0,  0,  0, -5,
+    -5,  0,  0,  0,  0,  0,  0, -5,
+    -5,  0,  0,  0,  0,  0,  0, -5,
+     0,  0,  0,  5,  5,  0,  0,  0]
+
+queenTable = [
+   -20,-10,-10, -5, -5,-10,-10,-20,
+   -10,  0,  0,  0,  0,  0,  0,-10,
+   -10,  0,  5,  5,  5,  5,  0,-10,
+    -5,  0,  5,  5,  5,  5,  0, -5,
+     0,  0,  5,  5,  5,  5,  0, -5,
+   -10,  5,  5,  5,  5,  5,  0,-10,
+   -10,  0,  5,  0,  0,  0,  0,-10,
+   -20,-10,-10, -5, -5,-10,-10,-20]
+
+kingMidgameTable = [
+   -30,-40,-40,-50,-50,-40,-40,-30,
+   -30,-40,-40,-50,-50,-40,-40,-30,
+   -30,-40,-40,-50,-50,-40,-40,-30,
+   -30,-40,-40,-50,-50,-40,-40,-30,
+   -20,-30,-30,-40,-40,-30,-30,-20,
+   -10,-20,-20,-20,-20,-20,-20,-10,
+    20, 20,  0,  0,  0,  0, 20, 20,
+    20, 30, 10,  0,  0, 10, 30, 20]
+
+kingEndgameTable = [
+   -50,-40,-30,-20,-20,-30,-40,-50,
+   -30,-20,-10,  0,  0,-10,-20,-30,
+   -30,-10, 20, 30, 30, 20,-10,-30,
+   -30,-10, 30, 40, 40, 30,-10,-30,
+   -30,-10, 30, 40, 40, 30,-10,-30,
+   -30,-10, 20, 30, 30, 20,-10,-30,
+   -30,-30,  0,  0,  0,  0,-30,-30,
+   -50,-30,-30,-30,-30,-30,-30,-50]
+
+midgameTables = {'P':pawnTable,'N':knightTable,'B':bishopTable,'R':rookTable,'Q':queenTable,'K':kingMidgameTable}
+endgameTables = {'P':pawnTable,'N':knightTable,'B':bishopTable,'R':rookTable,'Q':queenTable,'K':kingEndgameTable}
+
+
+'''
+Per piece code ('wN', 'bK', ...) tables indexed by square = row*8+col, signed so white is positive
+and black negative. Black reads the white table upside down.
+'''
+def buildSignedTables(tables):
+    signed = {}
+    for piece,table in tables.items():
+        signed['w'+piece] = list(table)
+        signed['b'+piece] = [-table[(7-sq//8)*8+sq%8] for sq in range(64)]
+    return signed
+
+midgameSquareValues = buildSignedTables(midgameTables)
+endgameSquareValues = buildSignedTables(endgameTables)
+signedPieceValues = {color+piece:(value if color == 'w' else -value) for color in 'wb' for piece,value in pieceValues.items()}
+piecePhases = {color+piece:weight for color in 'wb' for piece,weight in phaseWeights.items()}
+
+
+'''
+Blend the middlegame and endgame piece-square totals by how much material is left
+'''
+def taperedScore(material,midgame,endgame,phase):
+    phase = min(phase,maxPhase) # promotions can push the phase past its starting value
+    return material + (midgame*phase + endgame*(maxPhase-phase))//maxPhase
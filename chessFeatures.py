@@ -0,0 +1,211 @@
+"""
+Batch feature extraction and evaluation with NumPy, for training data and bulk scoring.
+A batch of positions becomes one array of piece codes (N, 64) - Move.pieceCodes, squares a8..h1 like
+self.board - and everything else is computed from that array for the whole batch at once: the
+(N, 12, 8, 8) piece planes, and the material and piece-square scores that GameState.evaluation gives
+one position at a time. No Python code runs per square; per position there is only a string join.
+
+NumPy is optional for the rest of the engine, so it is only imported here.
+
+Usage:
+    planes,extras = chessFeatures.extractFeatures(gamestates)        # GameStates or GameSnapshots
+    scores = chessFeatures.evaluateCodes(chessFeatures.boardCodes(gamestates))
+
+    positions = (gamestate for gamestate,_ in chessEpd.iterPositions("positions.epd"))
+    for codes,extras in chessFeatures.iterFeatureBatches(positions,batchSize = 65536):
+        ...
+
+    python chessFeatures.py positions.epd features.npz      # codes, extras and scores of every position
+"""
+
+import argparse
+import sys
+
+try:
+    import numpy as np
+except ImportError: # only this module needs numpy
+    np = None
+
+import chessEngine
+import chessEval
+
+pieceOrder = ('wP','wN','wB','wR','wQ','wK','bP','bN','bB','bR','bQ','bK') # plane i holds piece code i+1
+extraFeatureNames = ('whiteToMove','whiteKingside','whiteQueenside','blackKingside','blackQueenside',
+                     'enPassantA','enPassantB','enPassantC','enPassantD','enPassantE','enPassantF','enPassantG','enPassantH')
+defaultBatchSize = 65536
+
+
+def requireNumpy():
+    if np is None:
+        raise ImportError("chessFeatures needs numpy (pip install numpy)")
+
+
+if np is not None:
+    # a square of self.board read as two ASCII bytes in a little-endian uint16 -> its piece code
+    textCodes = np.zeros(1 << 16,dtype = np.uint8)
+    for piece,code in chessEngine.Move.pieceCodes.items():
+        textCodes[ord(piece[0]) | ord(piece[1]) << 8] = code
+
+    # per piece code and square: material, middlegame and endgame piece-square values and phase weight
+    # (the same numbers GameState.computeEvaluationTerms adds up)
+    evalTable = np.zeros((len(chessEngine.Move.pieceCodes),64,4),dtype = np.int64)
+    for piece,code in chessEngine.Move.pieceCodes.items():
+        if piece != '--':
+            evalTable[code,:,0] = chessEval.signedPieceValues[piece]
+            evalTable[code,:,1] = chessEval.midgameSquareValues[piece]
+            evalTable[code,:,2] = chessEval.endgameSquareValues[piece]
+            evalTable[code,:,3] = chessEval.piecePhases[piece]
+    # the four terms of a square packed into one int64, each made non-negative and given enough bits
+    # for the sum over 64 squares - a whole board is then scored by one lookup and one sum
+    termBias = -evalTable.min(axis = (0,1))
+    termShifts = []
+    shift = 0
+    for term in range(4):
+        termShifts.append(shift)
+        shift += int(64*(evalTable[:,:,term].max()+termBias[term])).bit_length()
+    assert shift < 64
+    packedEvalTable = ((evalTable+termBias) << np.array(termShifts,dtype = np.int64)).sum(axis = 2).ravel()
+    termMasks = [(1 << (end-start))-1 for start,end in zip(termShifts,termShifts[1:]+[shift])]
+
+
+'''
+What the features need from one position, copied out so the position can change afterwards
+(chessEpd.iterPositions reuses one GameState): the board (text of a GameState's board or the
+bytes of a GameSnapshot), side to move, castling rights index and en-passant file or -1
+'''
+def positionRecord(position):
+    if isinstance(position,chessEngine.GameSnapshot):
+        return (position.board,position.whiteToMove,position.castling,
+                position.enPassant % 8 if position.enPassant >= 0 else -1)
+    enPassant = position.enPassantPossible
+    return (''.join(map(''.join,position.board)),position.whiteToMove,position.currentCastlingRights.index(),
+            enPassant[1] if enPassant else -1)
+
+
+def recordCodes(records):
+    codes = np.empty((len(records),64),dtype = np.uint8)
+    textRows = [i for i,record in enumerate(records) if isinstance(record[0],str)]
+    if textRows:
+        text = ''.join([records[i][0] for i in textRows]).encode('ascii')
+        codes[textRows] = textCodes[np.frombuffer(text,dtype = '<u2').reshape(-1,64)]
+    if len(textRows) < len(records):
+        packedRows = [i for i,record in enumerate(records) if not isinstance(record[0],str)]
+        packed = b''.join([records[i][0] for i in packedRows])
+        codes[packedRows] = np.frombuffer(packed,dtype = np.uint8).reshape(-1,64)
+    return codes
+
+
+def recordExtras(records,dtype):
+    count = len(records)
+    extras = np.zeros((count,len(extraFeatureNames)),dtype = dtype)
+    if not count:
+        return extras
+    _,whiteToMove,castling,enPassant = zip(*records)
+    extras[:,0] = whiteToMove
+    castling = np.array(castling,dtype = np.uint8)
+    for bit in range(4):
+        extras[:,1+bit] = castling >> bit & 1
+    enPassant = np.array(enPassant,dtype = np.int8)
+    rows = np.flatnonzero(enPassant >= 0)
+    extras[rows,5+enPassant[rows]] = 1
+    return extras
+
+
+'''
+Piece codes of a batch of positions (GameStates or GameSnapshots) as a (N, 64) uint8 array -
+the compact form of a batch, 64 bytes a position
+'''
+def boardCodes(positions):
+    requireNumpy()
+    return recordCodes([positionRecord(position) for position in positions])
+
+
+'''
+The (N, 12, 8, 8) piece planes of an array of piece codes - plane i is 1 where pieceOrder[i] stands,
+row 0 is rank 8
+'''
+def codesToPlanes(codes,dtype = None):
+    requireNumpy()
+    codes = np.asarray(codes)
+    planes = codes[:,np.newaxis,:] == np.arange(1,13,dtype = codes.dtype)[:,np.newaxis]
+    return planes.reshape(-1,12,8,8).astype(dtype or np.float32)
+
+
+'''
+(planes, extras) for a batch of positions: the (N, 12, 8, 8) piece planes and a (N, 13) array of
+side to move, the four castling rights and the en-passant file one-hot (see extraFeatureNames)
+'''
+def extractFeatures(positions,dtype = None):
+    requireNumpy()
+    records = [positionRecord(position) for position in positions]
+    dtype = dtype or np.float32
+    return codesToPlanes(recordCodes(records),dtype),recordExtras(records,dtype)
+
+
+'''
+(codes, extras) for every batchSize positions of an iterable, however long - positions are read
+as they come, so the iterable may reuse one GameState
+'''
+def iterFeatureBatches(positions,batchSize = defaultBatchSize,dtype = None):
+    requireNumpy()
+    dtype = dtype or np.float32
+    records = []
+    for position in positions:
+        records.append(positionRecord(position))
+        if len(records) == batchSize:
+            yield recordCodes(records),recordExtras(records,dtype)
+            records = []
+    if records:
+        yield recordCodes(records),recordExtras(records,dtype)
+
+
+'''
+Material balance, middlegame and endgame piece-square totals and game phase of every position,
+as a (N, 4) int64 array - GameState.computeEvaluationTerms for the whole batch
+'''
+def evaluationTerms(codes):
+    requireNumpy()
+    index = np.asarray(codes).astype(np.intp)*64
+    index += np.arange(64)
+    packed = np.take(packedEvalTable,index).sum(axis = 1)
+    terms = np.empty((len(packed),4),dtype = np.int64)
+    for term in range(4):
+        terms[:,term] = (packed >> termShifts[term] & termMasks[term]) - 64*termBias[term]
+    return terms
+
+
+'''
+Static evaluation of every position in centipawns from white's point of view, equal to
+GameState.evaluation - the terms blended by game phase as chessEval.taperedScore does
+'''
+def evaluateCodes(codes):
+    terms = evaluationTerms(codes)
+    material,midgame,endgame = terms[:,0],terms[:,1],terms[:,2]
+    phase = np.minimum(terms[:,3],chessEval.maxPhase)
+    return material + (midgame*phase + endgame*(chessEval.maxPhase-phase))//chessEval.maxPhase
+
+
+def main(argv = None):
+    import chessEpd
+    parser = argparse.ArgumentParser(description = "Write the features and scores of the positions in an EPD/FEN file")
+    parser.add_argument("positions",help = "EPD or FEN file, one position per line (.gz too)")
+    parser.add_argument("out",help = ".npz file with codes (N, 64), extras (N, 13) and scores (N,)")
+    parser.add_argument("--batch-size",type = int,default = defaultBatchSize)
+    args = parser.parse_args(argv)
+    requireNumpy()
+
+    codes,extras,scores = [],[],[]
+    positions = (gamestate for gamestate,_ in chessEpd.iterPositions(args.positions,skipInvalid = True))
+    for batchCodes,batchExtras in iterFeatureBatches(positions,args.batch_size,np.uint8):
+        codes.append(batchCodes)
+        extras.append(batchExtras)
+        scores.append(evaluateCodes(batchCodes).astype(np.int32))
+    if not codes:
+        codes,extras,scores = [np.zeros((0,64),np.uint8)],[np.zeros((0,len(extraFeatureNames)),np.uint8)],[np.zeros(0,np.int32)]
+    np.savez(args.out,codes = np.concatenate(codes),extras = np.concatenate(extras),scores = np.concatenate(scores))
+    print("wrote %d positions to %s" % (sum(len(batch) for batch in codes),args.out))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
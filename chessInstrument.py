@@ -0,0 +1,216 @@
+"""
+Instrumentation for the engine: call counters, time per phase, nodes per second and profiling hooks.
+Nothing here runs unless asked for. GameState.enableInstrumentation() puts counting wrappers on
+that one game state's methods; until then the engine runs its normal methods, with no flag checks
+or counters in the hot paths. disableInstrumentation() takes the wrappers off again.
+
+    instrumentation = gamestate.enableInstrumentation()
+    ... play or search ...
+    print(instrumentation.summary())
+
+    with chessInstrument.profiled("search.prof"):     # cProfile around any block
+        searcher.findBestMove(gamestate,maxDepth = 6)
+
+    sampler = chessInstrument.SamplingProfiler()      # low-overhead sampling of a running thread
+    sampler.start(); ...; sampler.stop(); print(sampler.report())
+"""
+
+import collections
+import contextlib
+import cProfile
+import io
+import pstats
+import sys
+import threading
+import time
+
+# the GameState methods that get counted, and the ones whose time is added up as well
+countedMethods = ('makeMove','undoMove','getLegalMoves','getPossibleMoves','isUnderAttack')
+timedMethods = ('makeMove','undoMove','getLegalMoves')
+
+
+class Instrumentation():
+    '''
+    Counters and timers for the game states it is attached to.
+    movePool - Move.movePool, whose growth is the number of Move objects created
+    '''
+
+    def __init__(self,movePool = None) -> None:
+        self.movePool = movePool
+        self.counts = dict.fromkeys(countedMethods,0)
+        self.times = {} # phase name -> seconds
+        self.attached = []
+        self.reset()
+
+    '''
+    Zero every counter and timer and start measuring elapsed time again
+    '''
+    def reset(self):
+        for name in self.counts:
+            self.counts[name] = 0
+        self.times.clear()
+        self.startTime = time.perf_counter()
+        self.poolSizeAtStart = len(self.movePool) if self.movePool is not None else 0
+
+    '''
+    Replace the game state's counted methods with wrappers that count (and time) each call.
+    The wrappers are instance attributes, so other game states and the class are not affected.
+    '''
+    def attach(self,gamestate):
+        for name in countedMethods:
+            method = getattr(type(gamestate),name).__get__(gamestate)
+            setattr(gamestate,name,self.wrap(name,method,name in timedMethods))
+        self.attached.append(gamestate)
+
+    def detach(self,gamestate):
+        for name in countedMethods:
+            gamestate.__dict__.pop(name,None)
+        if gamestate in self.attached:
+            self.attached.remove(gamestate)
+
+    def wrap(self,name,method,timed):
+        counts = self.counts
+        if not timed:
+            def counted(*args,**kwargs):
+                counts[name] += 1
+                return method(*args,**kwargs)
+            return counted
+        times = self.times
+        clock = time.perf_counter
+        def countedAndTimed(*args,**kwargs):
+            counts[name] += 1
+            start = clock()
+            try:
+                return method(*args,**kwargs)
+            finally:
+                times[name] = times.get(name,0.0)+clock()-start
+        return countedAndTimed
+
+    '''
+    Add the time spent in a block to a named phase, e.g. with instrumentation.phase("search"):
+    '''
+    @contextlib.contextmanager
+    def phase(self,name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[name] = self.times.get(name,0.0)+time.perf_counter()-start
+
+    @property
+    def moveAllocations(self):
+        return len(self.movePool)-self.poolSizeAtStart if self.movePool is not None else 0
+
+    '''
+    Moves made per second of wall time since the last reset - every node of a search is one makeMove
+    '''
+    def nodesPerSecond(self):
+        elapsed = time.perf_counter()-self.startTime
+        return self.counts['makeMove']/elapsed if elapsed > 0 else 0.0
+
+    '''
+    Everything measured so far as a plain dict (JSON friendly)
+    '''
+    def report(self):
+        return {"elapsed":time.perf_counter()-self.startTime,"counts":dict(self.counts),
+                "moveAllocations":self.moveAllocations,"times":dict(self.times),
+                "nodesPerSecond":self.nodesPerSecond()}
+
+    '''
+    The report on one line, for logs and UCI info strings
+    '''
+    def summary(self):
+        report = self.report()
+        parts = ["%s=%d" % (name,count) for name,count in report["counts"].items()]
+        parts.append("moveAllocations=%d" % report["moveAllocations"])
+        parts += ["%sTime=%.3fs" % (name,seconds) for name,seconds in report["times"].items()]
+        parts.append("nps=%d" % report["nodesPerSecond"])
+        return " ".join(parts)
+
+
+'''
+Run a block under cProfile. The statistics are written to path, or printed (top limit entries
+sorted by sortBy) when no path is given.
+'''
+@contextlib.contextmanager
+def profiled(path = None,sortBy = "cumulative",limit = 25,out = sys.stderr):
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        if path:
+            profiler.dump_stats(path)
+        else:
+            pstats.Stats(profiler,stream = out).sort_stats(sortBy).print_stats(limit)
+
+
+class SamplingProfiler():
+    '''
+    Looks at what a thread is running every interval seconds from a background thread.
+    Much cheaper than cProfile, so it can be left on under real load; the counts are
+    statistical rather than exact. The sampler needs the interpreter lock to take a sample,
+    so in practice it samples about every sys.getswitchinterval() seconds at most.
+    '''
+
+    def __init__(self,interval = 0.001,threadId = None) -> None:
+        self.interval = interval
+        self.threadId = threadId # defaults to the thread that calls start
+        self.selfCounts = collections.Counter() # function at the top of the stack
+        self.totalCounts = collections.Counter() # function anywhere on the stack
+        self.samples = 0
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.threadId is None:
+            self.threadId = threading.get_ident()
+        self.stopped.clear()
+        self.thread = threading.Thread(target = self.run,name = "sampling-profiler",daemon = True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self,*exc):
+        self.stop()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.threadId)
+            if frame is None:
+                continue
+            self.samples += 1
+            self.selfCounts[self.describe(frame)] += 1
+            seen = set()
+            while frame is not None:
+                name = self.describe(frame)
+                if name not in seen: # recursion counts once per sample
+                    seen.add(name)
+                    self.totalCounts[name] += 1
+                frame = frame.f_back
+
+    def describe(self,frame):
+        code = frame.f_code
+        return "%s:%d(%s)" % (code.co_filename,code.co_firstlineno,code.co_name)
+
+    '''
+    The most sampled functions, by time spent in the function itself and including what it calls
+    '''
+    def report(self,limit = 20):
+        out = io.StringIO()
+        samples = max(self.samples,1)
+        print("%d samples" % self.samples,file = out)
+        for title,counts in (("self",self.selfCounts),("total",self.totalCounts)):
+            print("-- %s --" % title,file = out)
+            for name,count in counts.most_common(limit):
+                print("%6.1f%%  %s" % (100*count/samples,name),file = out)
+        return out.getvalue()
@@ -0,0 +1,195 @@
+"""
+Perft - counts the leaf nodes of the legal move tree to a fixed depth.
+The counts for the reference positions below are known, so any difference points to a
+move generation or make/undo bug, and the timings measure how fast the generator is.
+
+Usage:
+    python chessPerft.py                       # run the reference suite and the staged move check
+    python chessPerft.py --fen "<fen>" --depth 3 --divide
+    python chessPerft.py --bitboard --json results.json
+    python chessPerft.py --baseline old.json   # compare nodes per second with an earlier run
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+
+import chessEngine
+import chessBitboard
+
+# (name, fen, {depth: nodes}) - the standard positions from the chess programming wiki
+referencePositions = [
+    ("start", chessEngine.startFen,
+     {1:20,2:400,3:8902,4:197281,5:4865609}),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     {1:48,2:2039,3:97862,4:4085603}),
+    ("position3", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+     {1:14,2:191,3:2812,4:43238,5:674624}),
+    ("position4", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     {1:6,2:264,3:9467,4:422333}),
+    ("position4-mirrored", "r2q1rk1/pP1p2pp/Q4n2/bbp1p3/Np6/1B3NBn/pPPP1PPP/R3K2R b KQ - 0 1",
+     {1:6,2:264,3:9467,4:422333}),
+    ("position5", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     {1:44,2:1486,3:62379,4:2103487}),
+    ("position6", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     {1:46,2:2079,3:89890,4:3894594}),
+]
+
+
+'''
+Number of leaf nodes depth plies below the current position.
+buffers holds one move list per ply so the generator refills them instead of allocating new ones.
+'''
+def perft(gamestate,depth,buffers = None):
+    if depth == 0:
+        return 1
+    if buffers is None:
+        buffers = [[] for _ in range(depth)]
+    moves = gamestate.getLegalMoves(buffers[depth-1])
+    if depth == 1: # bulk counting - the number of legal moves is the number of leaves
+        return len(moves)
+    nodes = 0
+    for move in list(moves): # copy - the deeper plies reuse their own buffers, not this one
+        gamestate.makeMove(move)
+        nodes += perft(gamestate,depth-1,buffers)
+        gamestate.undoMove()
+    return nodes
+
+
+'''
+Perft split by the first move - the usual way to narrow a wrong count down to one move
+'''
+def divide(gamestate,depth):
+    counts = {}
+    for move in gamestate.getLegalMoves():
+        gamestate.makeMove(move)
+        counts[move.getChessNotation()] = perft(gamestate,depth-1)
+        gamestate.undoMove()
+    return counts
+
+
+def newGameState(fen,bitboard = False):
+    gamestate = chessBitboard.BitboardGameState() if bitboard else chessEngine.GameState()
+    gamestate.loadFen(fen)
+    return gamestate
+
+
+'''
+Time perft on one position. Returns a dict that is written out as part of the JSON results.
+'''
+def runPerft(name,fen,depth,expected = None,bitboard = False):
+    gamestate = newGameState(fen,bitboard)
+    start = time.perf_counter()
+    nodes = perft(gamestate,depth)
+    seconds = time.perf_counter()-start
+    return {"name":name,"fen":fen,"depth":depth,"nodes":nodes,"expected":expected,
+            "ok":expected is None or nodes == expected,"seconds":round(seconds,4),
+            "nps":round(nodes/seconds) if seconds > 0 else 0}
+
+
+'''
+Run every reference position at each depth whose expected node count is within maxNodes
+'''
+def runSuite(maxNodes,bitboard = False,depth = None,out = sys.stdout):
+    results = []
+    for name,fen,counts in referencePositions:
+        depths = [depth] if depth is not None else [d for d in sorted(counts) if counts[d] <= maxNodes]
+        for d in depths:
+            result = runPerft(name,fen,d,counts.get(d),bitboard)
+            results.append(result)
+            printResult(result,out)
+    return results
+
+
+'''
+Staged generation with killer and hash moves taken from other positions must hand out exactly the
+position's own legal moves, and making and undoing each must leave the position as it was.
+A killer such as Qd1-d4 equals Rd1-d4 by squares alone, so a foreign move played as-is would swap
+the piece on the board. Returns the positions that failed.
+'''
+def checkStagedMoves(bitboard = False,out = sys.stdout):
+    foreignMoves = []
+    for _,fen,_ in referencePositions+[("queen","4k3/8/8/8/8/8/8/3QK3 w - - 0 1",{})]:
+        foreignMoves += newGameState(fen,bitboard).getLegalMoves()
+    failed = []
+    for name,fen,_ in referencePositions+[("rook","4k3/8/8/8/8/8/8/3RK3 w - - 0 1",{})]:
+        gamestate = newGameState(fen,bitboard)
+        legalMoves = gamestate.getLegalMoves()
+        before = (gamestate.to_fen(),gamestate.zobristKey,gamestate.evalLog[-1])
+        ok = True
+        for i in range(0,len(foreignMoves),2):
+            staged = list(gamestate.generateStagedMoves(foreignMoves[i],foreignMoves[i+1:i+3]))
+            if len(staged) != len(legalMoves) or {id(move) for move in staged} != {id(move) for move in legalMoves}:
+                ok = False
+            for move in staged:
+                gamestate.makeMove(move)
+                gamestate.undoMove()
+            if (gamestate.to_fen(),gamestate.zobristKey,gamestate.evalLog[-1]) != before:
+                ok = False
+                gamestate.loadFen(fen)
+        if not ok:
+            failed.append(name)
+    print("staged moves with foreign killers: %s" % ("ok" if not failed else "FAIL "+", ".join(failed)),file = out)
+    return failed
+
+
+def printResult(result,out = sys.stdout):
+    status = "ok" if result["ok"] else "FAIL (expected %d)" % result["expected"]
+    print("%-20s depth %d  %10d nodes  %8.3fs  %8d nps  %s" % (result["name"],result["depth"],result["nodes"],
+                                                                 result["seconds"],result["nps"],status),file = out)
+
+
+'''
+Print how nodes per second changed against the results of an earlier run
+'''
+def compareWithBaseline(results,baselinePath,out = sys.stdout):
+    with open(baselinePath) as f:
+        baseline = {(r["name"],r["depth"]):r for r in json.load(f)["results"]}
+    for result in results:
+        old = baseline.get((result["name"],result["depth"]))
+        if old and old["nps"]:
+            print("%-20s depth %d  %8d -> %8d nps  (x%.2f)" % (result["name"],result["depth"],old["nps"],
+                                                                result["nps"],result["nps"]/old["nps"]),file = out)
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Perft correctness and speed suite for the chess engine")
+    parser.add_argument("--fen",help = "run a single position instead of the reference suite")
+    parser.add_argument("--depth",type = int,help = "depth to search (default: every depth within --max-nodes)")
+    parser.add_argument("--divide",action = "store_true",help = "print the node count below each root move")
+    parser.add_argument("--max-nodes",type = int,default = 200000,help = "skip reference depths with more nodes than this")
+    parser.add_argument("--bitboard",action = "store_true",help = "use the bitboard backend")
+    parser.add_argument("--json",help = "write the results to this file")
+    parser.add_argument("--baseline",help = "JSON results of an earlier run to compare speed against")
+    args = parser.parse_args(argv)
+
+    stagedFailed = []
+    if args.fen:
+        depth = args.depth or 3
+        if args.divide:
+            counts = divide(newGameState(args.fen,args.bitboard),depth)
+            for notation in sorted(counts):
+                print(notation+":",counts[notation])
+            print("total:",sum(counts.values()))
+        results = [runPerft("custom",args.fen,depth,bitboard = args.bitboard)]
+        printResult(results[0])
+    else:
+        results = runSuite(args.max_nodes,args.bitboard,args.depth)
+        stagedFailed = checkStagedMoves(args.bitboard)
+
+    totalNodes = sum(r["nodes"] for r in results)
+    totalSeconds = sum(r["seconds"] for r in results)
+    print("total: %d nodes in %.3fs, %d nps" % (totalNodes,totalSeconds,totalNodes/totalSeconds if totalSeconds else 0))
+    if args.baseline:
+        compareWithBaseline(results,args.baseline)
+    if args.json:
+        with open(args.json,"w") as f:
+            json.dump({"backend":"bitboard" if args.bitboard else "mailbox","python":platform.python_version(),
+                       "time":time.strftime("%Y-%m-%d %H:%M:%S"),"results":results},f,indent = 2)
+    return 0 if all(r["ok"] for r in results) and not stagedFailed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,241 @@
+"""
+PGN (Portable Game Notation) reading and writing.
+Games are read one at a time from a file of any size, and their SAN moves are turned into
+Move objects by matching them against the legal moves of the position, so every stage can be
+chained as generators without holding more than one game in memory:
+
+    for game in readGames("archive.pgn"):
+        for move,gamestate in replayGame(game):
+            ...   # gamestate is the position after move
+
+Paths are opened with chessEpd.openText, so .gz files can be read as they are.
+"""
+
+import re
+
+import chessEngine
+import chessEpd
+
+results = ("1-0","0-1","1/2-1/2","*")
+
+headerPattern = re.compile(r'\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+# comments, variations, NAGs, move numbers, results and moves - everything that can appear in movetext
+tokenPattern = re.compile(r'\{[^}]*\}?|;[^\n]*|\(|\)|\$\d+|\d+\.+|1-0|0-1|1/2-1/2|\*|[^\s{}()\[\];$.]+')
+sanPattern = re.compile(r'([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQnbrq]))?$')
+longPattern = re.compile(r'[a-h][1-8][a-h][1-8][NBRQnbrq]?$') # e2e4, g1f3, e7e8q - as UCI writes moves
+
+
+class PgnGame():
+    '''
+    headers - the tag pairs in file order, moves - SAN strings of the main line, result - e.g. "1-0"
+    '''
+
+    def __init__(self,headers = None,moves = None,result = "*") -> None:
+        self.headers = headers if headers is not None else {}
+        self.moves = moves if moves is not None else []
+        self.result = result
+
+    '''
+    FEN the game starts from - the FEN tag when there is one, else the usual starting position
+    '''
+    def startFen(self):
+        return self.headers.get("FEN",chessEngine.startFen)
+
+
+class PgnError(ValueError):
+    pass
+
+
+'''
+Yield a PgnGame for every game in a PGN file, lazily.
+source - a path, or any iterable of lines such as an open file or sys.stdin.
+'''
+def readGames(source):
+    if isinstance(source,str):
+        with chessEpd.openText(source) as lines:
+            yield from readGames(lines)
+        return
+    headers = {}
+    movetext = []
+    for line in source:
+        if line.startswith('%'): # escape mechanism - the rest of the line is ignored
+            continue
+        stripped = line.strip()
+        if stripped.startswith('[') and not (movetext and isOpenComment(movetext)):
+            if movetext: # tags after movetext start the next game, even when a result was left out
+                yield parseMovetext(headers,movetext)
+                headers = {}
+                movetext = []
+            for key,value in headerPattern.findall(stripped):
+                headers[key] = value.replace('\\"','"').replace('\\\\','\\')
+        elif stripped:
+            movetext.append(line)
+    if headers or movetext:
+        yield parseMovetext(headers,movetext)
+
+
+def isOpenComment(movetext):
+    text = ''.join(movetext)
+    return text.rfind('{') > text.rfind('}')
+
+
+'''
+Pull the main line out of a game's movetext - comments, NAGs, move numbers and variations are dropped
+'''
+def parseMovetext(headers,movetext):
+    moves = []
+    result = headers.get("Result","*")
+    depth = 0 # how many variations deep the current token is
+    for token in tokenPattern.findall(''.join(movetext)):
+        first = token[0]
+        if first == '(':
+            depth += 1
+        elif first == ')':
+            depth = max(0,depth-1)
+        elif depth or first in '{;$' or first.isdigit() and (token[-1] == '.' or token in results):
+            if token in results and not depth:
+                result = token
+        elif token == '*':
+            result = token
+        else:
+            moves.append(token.rstrip('!?')) # move annotations can be written straight after the move
+    return PgnGame(headers,moves,result)
+
+
+'''
+The legal move written in SAN (or long algebraic such as e2e4) in the current position.
+Only the pieces that fit the SAN are asked for their moves, rather than generating every legal
+move, unless legalMoves is passed in. Raises PgnError when no legal move or more than one matches.
+'''
+def sanToMove(gamestate,san,legalMoves = None):
+    text = san.rstrip('+#!?')
+    color = 'w' if gamestate.whiteToMove else 'b'
+    if text in ("O-O","0-0","O-O-O","0-0-0"):
+        kingSide = len(text) == 3
+        if legalMoves is None:
+            king = gamestate.whiteKingLocation if gamestate.whiteToMove else gamestate.blackKingLocation
+            legalMoves = gamestate.getLegalMoves(fromSquare = king)
+        for move in legalMoves:
+            if move.isCastleMove and (move.end_col > move.start_col) == kingSide:
+                return move
+        raise PgnError("illegal castling move: "+san)
+    if longPattern.match(text): # read as SAN, g1f3 would be a pawn on g1 - so try it as long algebraic first
+        notation = text[:4]+text[4:].lower()
+        if legalMoves is None:
+            fromSquare = (chessEngine.Move.ranksToRows[text[1]],chessEngine.Move.filesToCols[text[0]])
+            candidates = gamestate.getLegalMoves(fromSquare = fromSquare)
+        else:
+            candidates = legalMoves
+        for move in candidates:
+            if move.getChessNotation() == notation:
+                return move
+    match = sanPattern.match(text)
+    if match is None:
+        raise PgnError("cannot read move: "+san)
+    piece,fromFile,fromRank,target,promotion = match.groups()
+    piece = piece or 'P'
+    endCol = chessEngine.Move.filesToCols[target[0]]
+    endRow = chessEngine.Move.ranksToRows[target[1]]
+    fromCol = chessEngine.Move.filesToCols[fromFile] if fromFile else None
+    fromRow = chessEngine.Move.ranksToRows[fromRank] if fromRank else None
+    if piece == 'P' and fromCol is None: # a pawn that does not capture stays on its file
+        fromCol = endCol
+    promotion = promotion.upper() if promotion else ''
+    if legalMoves is None:
+        legalMoves = []
+        board = gamestate.board
+        pieceCode = color+piece
+        for r in range(8) if fromRow is None else (fromRow,):
+            row = board[r]
+            for c in range(8) if fromCol is None else (fromCol,):
+                if row[c] == pieceCode:
+                    legalMoves += gamestate.getLegalMoves(fromSquare = (r,c))
+    found = None
+    for move in legalMoves:
+        if (move.end_row == endRow and move.end_col == endCol and move.piece_moved[1] == piece
+                and (fromCol is None or move.start_col == fromCol) and (fromRow is None or move.start_row == fromRow)
+                and (move.promotionChoice == promotion or (not promotion and move.promotionChoice == 'Q'))):
+            if found is not None:
+                raise PgnError("ambiguous move: "+san)
+            found = move
+    if found is None:
+        raise PgnError("illegal move: "+san)
+    return found
+
+
+'''
+Play a game's moves on gamestate (a new GameState by default) and yield (move, gamestate) after each one.
+The same game state object is yielded every time, already moved forward.
+'''
+def replayGame(game,gamestate = None):
+    if gamestate is None:
+        gamestate = chessEngine.GameState()
+    gamestate.loadFen(game.startFen())
+    for number,san in enumerate(game.moves):
+        try:
+            move = sanToMove(gamestate,san)
+        except PgnError as error:
+            raise PgnError("%s (ply %d of %s vs %s)" % (error,number+1,game.headers.get("White","?"),
+                                                          game.headers.get("Black","?"))) from None
+        gamestate.makeMove(move)
+        yield move,gamestate
+
+
+'''
+SAN of every move in the game state's move log. The moves are undone and replayed to
+produce it, so the game state ends where it started.
+'''
+def getSanMoves(gamestate):
+    moves = list(gamestate.moveLog)
+    for _ in moves:
+        gamestate.undoMove()
+    sanMoves = []
+    for move in moves:
+        sanMoves.append(move.getSanNotation(gamestate))
+        gamestate.makeMove(move)
+    return sanMoves
+
+
+'''
+The game in the game state's move log as PGN text. headers are added to (and override)
+the seven tag roster; the result is taken from the headers or from a checkmate/stalemate on the board.
+'''
+def gameToPgn(gamestate,headers = None,lineLength = 80):
+    moves = list(gamestate.moveLog)
+    for _ in moves:
+        gamestate.undoMove()
+    firstFen = gamestate.to_fen()
+    firstNumber = gamestate.fullmoveNumber
+    whiteStarts = gamestate.whiteToMove
+    tokens = []
+    for i,move in enumerate(moves):
+        if (i+(0 if whiteStarts else 1)) % 2 == 0:
+            tokens.append("%d." % (firstNumber+(i+(0 if whiteStarts else 1))//2))
+        elif i == 0:
+            tokens.append("%d..." % firstNumber)
+        tokens.append(move.getSanNotation(gamestate))
+        gamestate.makeMove(move)
+
+    allHeaders = {"Event":"?","Site":"?","Date":"????.??.??","Round":"?","White":"?","Black":"?","Result":"*"}
+    if not gamestate.getLegalMoves():
+        if gamestate.isInCheck():
+            allHeaders["Result"] = "0-1" if gamestate.whiteToMove else "1-0"
+        else:
+            allHeaders["Result"] = "1/2-1/2"
+    if firstFen != chessEngine.startFen:
+        allHeaders["SetUp"] = "1"
+        allHeaders["FEN"] = firstFen
+    allHeaders.update(headers or {})
+    tokens.append(allHeaders["Result"])
+
+    lines = ['[%s "%s"]' % (key,str(value).replace('\\','\\\\').replace('"','\\"')) for key,value in allHeaders.items()]
+    lines.append('')
+    line = ''
+    for token in tokens:
+        if line and len(line)+1+len(token) > lineLength:
+            lines.append(line)
+            line = token
+        else:
+            line = line+' '+token if line else token
+    lines.append(line)
+    return '\n'.join(lines)+'\n'
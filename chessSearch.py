@@ -0,0 +1,304 @@
+"""
+Alpha-beta search on top of GameState.
+Iterative deepening negamax with a fixed-size transposition table, quiescence search over captures
+and time/node budgets. findBestMove returns the best move together with its principal variation.
+Moves are taken from GameState.generateStagedMoves, so a node that cuts off early never generates its quiet moves.
+"""
+
+import time
+
+import chessEngine
+import chessEval
+
+mateScore = 100000 # score of being mated right now, mate in n plies scores mateScore-n
+infinity = 1000000
+maxPly = 128
+
+pieceValues = chessEval.pieceValues
+
+# what a transposition table score says about the real value of the position
+exactScore,lowerBound,upperBound = 0,1,2
+
+
+'''
+Static evaluation from the point of view of the side to move (GameState keeps it up to date incrementally)
+'''
+def evaluate(gamestate):
+    score = gamestate.evaluation
+    return score if gamestate.whiteToMove else -score
+
+
+'''
+Captures first, most valuable victim / least valuable attacker, then promotions, then the rest
+'''
+def moveOrderScore(move):
+    score = 0
+    if move.piece_captured != '--':
+        score += 10*pieceValues[move.piece_captured[1]] - pieceValues[move.piece_moved[1]] + 10000
+    if move.isPawnPromotion:
+        score += pieceValues[move.promotionChoice]
+    return score
+
+
+class TranspositionTable():
+    '''
+    Fixed number of slots indexed by the low bits of the Zobrist key.
+    Depth-preferred replacement: an entry from the current search is only overwritten by a search
+    of the same depth or deeper, entries left over from earlier searches can always be replaced.
+    '''
+
+    def __init__(self,size = 1 << 18) -> None:
+        if size & (size-1):
+            raise ValueError("transposition table size must be a power of two")
+        self.mask = size-1
+        self.entries = [None]*size # (key, depth, score, flag, move, generation)
+        self.generation = 0
+
+    def newSearch(self):
+        self.generation += 1
+
+    def clear(self):
+        self.entries = [None]*(self.mask+1)
+        self.generation = 0
+
+    def probe(self,key):
+        entry = self.entries[key & self.mask]
+        if entry is not None and entry[0] == key:
+            return entry
+        return None
+
+    def store(self,key,depth,score,flag,move):
+        index = key & self.mask
+        entry = self.entries[index]
+        if entry is None or entry[5] != self.generation or depth >= entry[1] or entry[0] == key:
+            self.entries[index] = (key,depth,score,flag,move,self.generation)
+
+
+class SearchResult():
+    def __init__(self,bestMove,score,depth,pv,nodes,seconds) -> None:
+        self.bestMove = bestMove
+        self.score = score
+        self.depth = depth
+        self.pv = pv # list of Moves, starting with bestMove
+        self.nodes = nodes
+        self.seconds = seconds
+
+    '''
+    Moves until mate (positive when the side to move mates), None when the score is not a mate
+    '''
+    def mateIn(self):
+        if abs(self.score) < mateScore-maxPly:
+            return None
+        plies = mateScore-abs(self.score)
+        return (plies+1)//2 if self.score > 0 else -((plies+1)//2)
+
+
+class SearchStopped(Exception):
+    pass
+
+
+class Searcher():
+    '''
+    Holds the transposition table between searches, so later searches (and later iterations of
+    the same search) start from what was already found
+    '''
+
+    def __init__(self,ttSize = 1 << 18,book = None) -> None:
+        self.tt = TranspositionTable(ttSize)
+        self.book = book # chessBook.OpeningBook - looked up before searching
+        self.stopRequested = False
+        self.nodes = 0
+        self.deadline = None
+        self.nodeLimit = None
+        self.stopEvent = None
+        self.pv = [[] for _ in range(maxPly+1)] # pv[ply] - best line found from ply onwards
+        self.killers = [[None,None] for _ in range(maxPly+1)] # quiet moves that caused a cutoff at each ply
+
+    '''
+    Ask a running search to return as soon as possible (safe to call from another thread)
+    '''
+    def stop(self):
+        self.stopRequested = True
+
+    '''
+    Search the position and return a SearchResult for the deepest iteration that finished.
+    timeLimit is in seconds; onIteration(result) is called after every completed depth.
+    stopEvent - optional threading.Event that stops the search once set, even if it was set
+    before the search got going (a stop() that comes too early is cleared by the search starting).
+    A position found in the opening book is answered from the book without searching (depth 0).
+    The game state is back to where it started when this returns.
+    '''
+    def findBestMove(self,gamestate,maxDepth = 64,timeLimit = None,nodeLimit = None,onIteration = None,stopEvent = None):
+        start = time.perf_counter()
+        if self.book is not None:
+            bookMove = self.book.pickMove(gamestate)
+            if bookMove is not None:
+                return SearchResult(bookMove,0,0,[bookMove],0,time.perf_counter()-start)
+        self.stopRequested = False
+        self.stopEvent = stopEvent
+        self.nodes = 0
+        self.deadline = start+timeLimit if timeLimit is not None else None
+        self.nodeLimit = nodeLimit
+        self.tt.newSearch()
+        self.killers = [[None,None] for _ in range(maxPly+1)]
+
+        result = None
+        rootMoves = gamestate.getLegalMoves()
+        if not rootMoves:
+            return SearchResult(None,-mateScore if gamestate.isInCheck() else 0,0,[],0,0.0)
+        logLength = len(gamestate.moveLog)
+        for depth in range(1,min(maxDepth,maxPly)+1):
+            try:
+                score = self.negamax(gamestate,depth,-infinity,infinity,0)
+            except SearchStopped:
+                while len(gamestate.moveLog) > logLength: # unwind the moves the search was in the middle of
+                    gamestate.undoMove()
+                break
+            pv = list(self.pv[0])
+            result = SearchResult(pv[0] if pv else rootMoves[0],score,depth,pv,self.nodes,time.perf_counter()-start)
+            if onIteration is not None:
+                onIteration(result)
+            if abs(score) >= mateScore-depth: # a forced mate was found, deeper searches cannot improve it
+                break
+            # the next iteration takes several times longer than this one - do not start what cannot finish
+            if self.deadline is not None and time.perf_counter()-start > (self.deadline-start)/2:
+                break
+
+        if result is None: # stopped before the first iteration finished
+            rootMoves.sort(key = moveOrderScore,reverse = True)
+            result = SearchResult(rootMoves[0],0,0,[rootMoves[0]],self.nodes,time.perf_counter()-start)
+        result.nodes = self.nodes
+        result.seconds = time.perf_counter()-start
+        return result
+
+    def checkLimits(self):
+        if self.stopRequested or (self.stopEvent is not None and self.stopEvent.is_set()):
+            raise SearchStopped()
+        if self.nodeLimit is not None and self.nodes >= self.nodeLimit:
+            raise SearchStopped()
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            raise SearchStopped()
+
+    def negamax(self,gamestate,depth,alpha,beta,ply):
+        self.nodes += 1
+        if self.nodes & 1023 == 0:
+            self.checkLimits()
+        self.pv[ply] = []
+        key = gamestate.zobristKey
+        if ply > 0 and (gamestate.positionCounts[key] >= 2 or gamestate.halfmoveClock >= 100):
+            return 0 # a repetition inside the search is scored as a draw
+        if depth <= 0 or ply >= maxPly:
+            return self.quiescence(gamestate,alpha,beta,ply)
+
+        alphaOriginal = alpha
+        ttMove = None
+        entry = self.tt.probe(key)
+        if entry is not None:
+            ttMove = entry[4]
+            if entry[1] >= depth and ply > 0:
+                score = scoreFromTable(entry[2],ply)
+                if entry[3] == exactScore:
+                    return score
+                elif entry[3] == lowerBound:
+                    alpha = max(alpha,score)
+                else:
+                    beta = min(beta,score)
+                if alpha >= beta:
+                    return score
+
+        bestScore = -infinity
+        bestMove = None
+        for move in gamestate.generateStagedMoves(ttMove,self.killers[ply]):
+            gamestate.makeMove(move)
+            score = -self.negamax(gamestate,depth-1,-beta,-alpha,ply+1)
+            gamestate.undoMove()
+            if score > bestScore:
+                bestScore = score
+                bestMove = move
+                if score > alpha:
+                    alpha = score
+                    self.pv[ply] = [move]+self.pv[ply+1]
+                    if alpha >= beta:
+                        if move.piece_captured == '--' and not move.isPawnPromotion:
+                            self.storeKiller(move,ply)
+                        break
+        if bestMove is None:
+            return -mateScore+ply if gamestate.isInCheck() else 0
+
+        if bestScore <= alphaOriginal:
+            flag = upperBound
+        elif bestScore >= beta:
+            flag = lowerBound
+        else:
+            flag = exactScore
+        self.tt.store(key,depth,scoreToTable(bestScore,ply),flag,bestMove)
+        return bestScore
+
+    '''
+    Keep the two most recent quiet moves that caused a beta cutoff at this ply
+    '''
+    def storeKiller(self,move,ply):
+        killers = self.killers[ply]
+        if killers[0] != move:
+            killers[1] = killers[0]
+            killers[0] = move
+
+    '''
+    Search only captures and promotions until the position is quiet, so the evaluation
+    is never taken in the middle of an exchange. When in check every evasion is searched instead,
+    since standing pat is not an option and a position with no evasions is mate.
+    '''
+    def quiescence(self,gamestate,alpha,beta,ply):
+        self.nodes += 1
+        if self.nodes & 1023 == 0:
+            self.checkLimits()
+        self.pv[ply] = []
+        inCheck = gamestate.isInCheck()
+        if inCheck and ply < maxPly:
+            moves = gamestate.getLegalMoves()
+            if not moves:
+                return -mateScore+ply
+        else:
+            standPat = evaluate(gamestate)
+            if standPat >= beta or ply >= maxPly:
+                return standPat
+            if standPat > alpha:
+                alpha = standPat
+            moves = gamestate.getLegalMoves(genMode = chessEngine.tacticalMoves)
+        moves.sort(key = moveOrderScore,reverse = True)
+        for move in moves:
+            gamestate.makeMove(move)
+            score = -self.quiescence(gamestate,-beta,-alpha,ply+1)
+            gamestate.undoMove()
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+                self.pv[ply] = [move]+self.pv[ply+1]
+        return alpha
+
+
+'''
+Mate scores are stored relative to the position, not the root, so they stay right
+when the same position is reached at a different ply
+'''
+def scoreToTable(score,ply):
+    if score >= mateScore-maxPly:
+        return score+ply
+    if score <= -mateScore+maxPly:
+        return score-ply
+    return score
+
+def scoreFromTable(score,ply):
+    if score >= mateScore-maxPly:
+        return score-ply
+    if score <= -mateScore+maxPly:
+        return score+ply
+    return score
+
+
+'''
+Convenience wrapper for a one-off search without keeping a Searcher around
+'''
+def findBestMove(gamestate,maxDepth = 64,timeLimit = None,nodeLimit = None):
+    return Searcher().findBestMove(gamestate,maxDepth,timeLimit,nodeLimit)
@@ -0,0 +1,405 @@
+"""
+Headless game server - hosts many games at once over JSON lines, on a TCP socket or stdin/stdout.
+
+Usage:
+    python chessServer.py --port 8765            # TCP, one JSON request per line
+    python chessServer.py --stdin                # same protocol on stdin/stdout
+    python chessServer.py --port 8765 --processes 8
+    python chessServer.py --self-test            # play a short game through the protocol and check it
+
+Requests (an optional "id" is copied into the reply, so clients can match replies to requests):
+    {"cmd": "new", "fen": "<optional FEN>"}             -> {"ok": true, "game": "<game id>", ...}
+    {"cmd": "move", "game": "<game id>", "move": "e2e4"} (long algebraic or SAN)
+    {"cmd": "undo", "game": "<game id>"}
+    {"cmd": "state", "game": "<game id>"}                -> fen, status, result, moves so far
+    {"cmd": "moves", "game": "<game id>"}                -> legal moves
+    {"cmd": "close", "game": "<game id>"}
+    {"cmd": "stats"}
+Every reply has "ok"; failed requests carry an "error" message instead of the result.
+
+A game is not kept as a GameState between requests: the server holds its snapshot (a few hundred
+bytes, see GameState.snapshot) and the moves played, and each request restores the snapshot into a
+GameState owned by the executor thread or process that handles it. Per-game memory stays small and
+does not depend on the engine's internals, and the move validation runs off the event loop.
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import io
+import json
+import os
+import signal
+import sys
+import threading
+import uuid
+
+import chessEngine
+import chessPgn
+
+moveCacheSize = 8192
+
+# one GameState (and move cache) per executor thread or process, made on first use
+workerLocal = threading.local()
+
+
+def workerGameState():
+    gamestate = getattr(workerLocal,"gamestate",None)
+    if gamestate is None:
+        gamestate = workerLocal.gamestate = chessEngine.GameState(chessEngine.MoveCache(moveCacheSize))
+    return gamestate
+
+
+'''
+Everything a reply says about a position: FEN, side to move, game status and result
+'''
+def describePosition(gamestate,legalMoves):
+    status,result = gamestate.getGameStatus(legalMoves)
+    return {"fen":gamestate.to_fen(),"turn":"white" if gamestate.whiteToMove else "black",
+            "status":status,"result":result,"check":gamestate.isInCheck()}
+
+
+# the functions below run in the executor - they only take and return plain, picklable values
+
+def startGame(fen):
+    gamestate = workerGameState()
+    gamestate.loadFen(fen)
+    reply = describePosition(gamestate,gamestate.getCachedLegalMoves())
+    return gamestate.snapshot(),reply
+
+
+'''
+Play moveText (long algebraic or SAN) in the snapshot's position.
+Returns (new snapshot, long algebraic of the move, reply fields).
+'''
+def playMove(snapshot,moveText):
+    gamestate = workerGameState()
+    gamestate.restore(snapshot)
+    legalMoves = gamestate.getCachedLegalMoves()
+    if not legalMoves or gamestate.getGameStatus(legalMoves)[0] != 'ongoing':
+        raise ValueError("the game is over")
+    move = chessPgn.sanToMove(gamestate,moveText,legalMoves)
+    san = move.getSanNotation(gamestate,legalMoves)
+    gamestate.makeMove(move)
+    reply = describePosition(gamestate,gamestate.getCachedLegalMoves())
+    reply["san"] = san
+    return gamestate.snapshot(),move.getChessNotation(),reply
+
+
+'''
+Position after playing moves (long algebraic) from the snapshot - used to take moves back
+'''
+def replayMoves(snapshot,moves):
+    gamestate = workerGameState()
+    gamestate.restore(snapshot)
+    for moveText in moves:
+        gamestate.makeMove(chessPgn.sanToMove(gamestate,moveText,gamestate.getCachedLegalMoves()))
+    return gamestate.snapshot(),describePosition(gamestate,gamestate.getCachedLegalMoves())
+
+
+def legalMoves(snapshot):
+    gamestate = workerGameState()
+    gamestate.restore(snapshot)
+    return sorted(move.getChessNotation() for move in gamestate.getCachedLegalMoves())
+
+
+class Session():
+    '''
+    One hosted game: the starting snapshot, the moves played (long algebraic, for undo and
+    replies) and the current snapshot and its last description
+    '''
+    __slots__ = ('gameId','start','moves','current','position','lock')
+
+    def __init__(self,gameId,snapshot,position) -> None:
+        self.gameId = gameId
+        self.start = snapshot
+        self.moves = []
+        self.current = snapshot
+        self.position = position
+        self.lock = asyncio.Lock() # requests on one game are handled one at a time, in order
+
+
+class RequestError(Exception):
+    pass
+
+
+class GameServer():
+    '''
+    The games and the request handling, independent of the transport.
+    executor - where move validation runs; a thread pool by default
+    '''
+
+    def __init__(self,executor = None,maxGames = 100000) -> None:
+        self.executor = executor or concurrent.futures.ThreadPoolExecutor(min(8,os.cpu_count() or 1))
+        self.maxGames = maxGames
+        self.sessions = {}
+        self.requests = 0
+
+    async def run(self,function,*args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor,function,*args)
+
+    '''
+    Handle one request dict and return the reply dict. Never raises for a bad request.
+    '''
+    async def handle(self,request):
+        self.requests += 1
+        reply = {}
+        if isinstance(request,dict) and "id" in request:
+            reply["id"] = request["id"]
+        try:
+            if not isinstance(request,dict):
+                raise RequestError("a request must be a JSON object")
+            command = request.get("cmd")
+            handler = self.commands.get(command)
+            if handler is None:
+                raise RequestError("unknown command %r" % command)
+            reply.update(await handler(self,request))
+            reply["ok"] = True
+        except (RequestError,ValueError) as error:
+            reply["ok"] = False
+            reply["error"] = str(error)
+        except Exception as error: # a position the engine cannot handle - fail this request, not the server
+            reply["ok"] = False
+            reply["error"] = "internal error: %s: %s" % (type(error).__name__,error)
+        return reply
+
+    def getSession(self,request):
+        gameId = request.get("game")
+        if not isinstance(gameId,str):
+            raise RequestError("the request needs a \"game\" id string")
+        session = self.sessions.get(gameId)
+        if session is None:
+            raise RequestError("no game %r" % gameId)
+        return session
+
+    async def newGame(self,request):
+        if len(self.sessions) >= self.maxGames:
+            raise RequestError("the server is full (%d games)" % self.maxGames)
+        fen = request.get("fen") or chessEngine.startFen
+        if not isinstance(fen,str):
+            raise RequestError("\"fen\" must be a string")
+        snapshot,position = await self.run(startGame,fen)
+        gameId = uuid.uuid4().hex
+        self.sessions[gameId] = Session(gameId,snapshot,position)
+        return dict(position,game = gameId)
+
+    async def move(self,request):
+        session = self.getSession(request)
+        moveText = request.get("move")
+        if not isinstance(moveText,str) or not moveText:
+            raise RequestError("move needs a \"move\" string")
+        async with session.lock:
+            snapshot,notation,position = await self.run(playMove,session.current,moveText)
+            session.current = snapshot
+            session.moves.append(notation)
+            session.position = {key:value for key,value in position.items() if key != "san"}
+        return dict(position,game = session.gameId,move = notation)
+
+    async def undo(self,request):
+        session = self.getSession(request)
+        async with session.lock:
+            if not session.moves:
+                raise RequestError("no moves to undo")
+            snapshot,position = await self.run(replayMoves,session.start,session.moves[:-1])
+            undone = session.moves.pop()
+            session.current = snapshot
+            session.position = position
+        return dict(position,game = session.gameId,undone = undone)
+
+    async def state(self,request):
+        session = self.getSession(request)
+        return dict(session.position,game = session.gameId,moves = list(session.moves))
+
+    async def moves(self,request):
+        session = self.getSession(request)
+        return {"game":session.gameId,"moves":await self.run(legalMoves,session.current)}
+
+    async def close(self,request):
+        session = self.getSession(request)
+        del self.sessions[session.gameId]
+        return {"game":session.gameId}
+
+    async def stats(self,request):
+        return {"games":len(self.sessions),"requests":self.requests}
+
+    commands = {"new":newGame,"move":move,"undo":undo,"state":state,"moves":moves,"close":close,"stats":stats}
+
+    '''
+    Answer JSON lines from reader on writer until the input ends. Requests from one client are
+    handled concurrently, so replies can come back in a different order - use "id" to match them.
+    '''
+    async def serveStream(self,reader,writer):
+        pending = set()
+        writeLock = asyncio.Lock()
+
+        async def answer(line):
+            try:
+                request = json.loads(line)
+            except ValueError:
+                reply = {"ok":False,"error":"not valid JSON"}
+            else:
+                reply = await self.handle(request)
+            async with writeLock:
+                writer.write((json.dumps(reply)+"\n").encode())
+                await writer.drain()
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.strip():
+                    task = asyncio.ensure_future(answer(line))
+                    pending.add(task)
+                    task.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.gather(*pending)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+class FileWriter():
+    '''
+    The writer side of serveStream for a plain binary file (stdout redirected to a file, or an
+    in-memory buffer) - the same write / drain / close calls as asyncio.StreamWriter
+    '''
+
+    def __init__(self,output) -> None:
+        self.output = output
+
+    def write(self,data):
+        self.output.write(data)
+
+    async def drain(self):
+        self.output.flush()
+
+    def close(self):
+        self.output.flush()
+
+
+'''
+Feed lines read from a plain file into reader, on an executor thread so the loop is never blocked
+'''
+async def feedFile(reader,source):
+    loop = asyncio.get_running_loop()
+    while True:
+        line = await loop.run_in_executor(None,source.readline)
+        if not line:
+            break
+        reader.feed_data(line)
+    reader.feed_eof()
+
+
+'''
+A reader and writer on stdin/stdout. Pipes, sockets and terminals get asyncio transports; a
+regular file (python chessServer.py --stdin < requests.jsonl > replies.jsonl) cannot, so it is
+read on a thread and written to directly.
+'''
+async def openStdio():
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    try:
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader),sys.stdin)
+    except ValueError: # not a pipe, socket or terminal
+        reader.feeder = asyncio.ensure_future(feedFile(reader,sys.stdin.buffer))
+    try:
+        transport,protocol = await loop.connect_write_pipe(asyncio.streams.FlowControlMixin,sys.stdout)
+    except ValueError:
+        return reader,FileWriter(sys.stdout.buffer)
+    return reader,asyncio.StreamWriter(transport,protocol,reader,loop)
+
+
+'''
+Drive a server through serveStream the way a client would - new game, moves, an illegal move,
+undo, state and close - and check every reply. Used by --self-test; returns the failed steps.
+'''
+async def selfTest(server):
+    async def ask(request):
+        reader = asyncio.StreamReader()
+        reader.feed_data((json.dumps(request)+"\n").encode())
+        reader.feed_eof()
+        output = io.BytesIO()
+        await server.serveStream(reader,FileWriter(output))
+        return json.loads(output.getvalue())
+
+    failed = []
+    def check(step,ok):
+        if not ok:
+            failed.append(step)
+
+    reply = await ask({"cmd":"new","id":1})
+    check("new",reply["ok"] and reply["id"] == 1 and reply["fen"] == chessEngine.startFen)
+    game = reply.get("game")
+    for moveText,notation in (("e4","e2e4"),("e7e5","e7e5"),("g1f3","g1f3")):
+        reply = await ask({"cmd":"move","game":game,"move":moveText})
+        check("move "+moveText,reply["ok"] and reply["move"] == notation and reply["status"] == "ongoing")
+    reply = await ask({"cmd":"move","game":game,"move":"Ke2"})
+    check("illegal move",not reply["ok"] and "error" in reply)
+    reply = await ask({"cmd":"undo","game":game})
+    check("undo",reply["ok"] and reply["undone"] == "g1f3" and reply["turn"] == "white")
+    reply = await ask({"cmd":"state","game":game})
+    check("state",reply["ok"] and reply["moves"] == ["e2e4","e7e5"]
+          and reply["fen"] == "rnbqkbnr/pppp1ppp/8/4p3/4P3/8/PPPP1PPP/RNBQKBNR w KQkq e6 0 2")
+    for moveText in ("Bc4","Nc6","Qh5","Nf6","Qxf7#"):
+        reply = await ask({"cmd":"move","game":game,"move":moveText})
+    check("checkmate",reply["ok"] and reply["status"] == "checkmate" and reply["result"] == "1-0")
+    reply = await ask({"cmd":"move","game":game,"move":"a3"})
+    check("move after the game",not reply["ok"])
+    reply = await ask({"cmd":"new","fen":"4k3/4Q3/8/8/8/8/8/4K3 w - - 0 1"})
+    check("bad fen",not reply["ok"])
+    reply = await ask({"cmd":"move","game":[1],"move":"e4"})
+    check("bad game id",not reply["ok"])
+    reply = await ask({"cmd":"close","game":game})
+    check("close",reply["ok"])
+    reply = await ask({"cmd":"state","game":game})
+    check("closed game",not reply["ok"])
+    return failed
+
+
+async def serve(args):
+    if args.processes:
+        executor = concurrent.futures.ProcessPoolExecutor(args.processes)
+    else:
+        executor = concurrent.futures.ThreadPoolExecutor(args.threads)
+    server = GameServer(executor,args.max_games)
+    try: # a SIGTERM ends the server through the finally below, so process pool workers are not left behind
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM,asyncio.current_task().cancel)
+    except NotImplementedError: # no signal handlers on this platform's event loop
+        pass
+    try:
+        if args.self_test:
+            failed = await selfTest(server)
+            print("self test: %s" % ("ok" if not failed else "FAIL "+", ".join(failed)))
+            return 1 if failed else 0
+        if args.stdin:
+            reader,writer = await openStdio()
+            await server.serveStream(reader,writer)
+        else:
+            listener = await asyncio.start_server(server.serveStream,args.host,args.port)
+            print("serving on %s:%d" % (args.host,args.port),file = sys.stderr)
+            async with listener:
+                await listener.serve_forever()
+    finally:
+        executor.shutdown(wait = False,cancel_futures = True)
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Host many chess games over JSON lines")
+    parser.add_argument("--stdin",action = "store_true",help = "serve one client on stdin/stdout instead of TCP")
+    parser.add_argument("--host",default = "127.0.0.1")
+    parser.add_argument("--port",type = int,default = 8765)
+    parser.add_argument("--threads",type = int,default = min(8,os.cpu_count() or 1),help = "executor threads for move validation")
+    parser.add_argument("--processes",type = int,help = "validate moves in this many processes instead of threads")
+    parser.add_argument("--max-games",type = int,default = 100000,help = "refuse new games beyond this many")
+    parser.add_argument("--self-test",action = "store_true",help = "play a short game through the request handling and check the replies")
+    args = parser.parse_args(argv)
+    try:
+        return asyncio.run(serve(args)) or 0
+    except (KeyboardInterrupt,asyncio.CancelledError):
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
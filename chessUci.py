@@ -0,0 +1,197 @@
+"""
+UCI (Universal Chess Interface) front end, for running the engine under a GUI or match runner.
+Reads commands from stdin and answers on stdout; nothing here touches pygame.
+
+Usage:
+    python -m chessUci             # bitboard backend
+    python -m chessUci --mailbox   # plain 8x8 board backend
+    python -m chessUci --book book.bin   # answer opening positions from a book (see chessBook.py)
+    python -m chessUci --stats           # report engine counters as an info string after every search
+
+Supported commands: uci, isready, ucinewgame, position (startpos | fen <fen>) [moves ...],
+go [depth n] [movetime ms] [nodes n] [wtime ms] [btime ms] [winc ms] [binc ms] [movestogo n] [infinite],
+stop, quit. Anything else is ignored, as the protocol asks.
+"""
+
+import argparse
+import sys
+import threading
+
+import chessEngine
+import chessBitboard
+import chessBook
+import chessSearch
+
+engineName = "Chess"
+goIntegerOptions = ("depth","movetime","nodes","wtime","btime","winc","binc","movestogo")
+
+
+class UciEngine():
+    '''
+    One engine session. Searches run on a thread so stop and isready are answered while they think.
+    '''
+
+    def __init__(self,bitboard = True,out = sys.stdout,book = None,stats = False) -> None:
+        self.out = out
+        self.outputLock = threading.Lock() # the search thread writes info lines too
+        self.gamestate = chessBitboard.BitboardGameState() if bitboard else chessEngine.GameState()
+        self.searcher = chessSearch.Searcher(book = book)
+        self.instrumentation = self.gamestate.enableInstrumentation() if stats else None
+        self.searchThread = None
+        self.stopEvent = threading.Event() # set by stop - ends the running search
+        self.infinite = False
+
+    def send(self,line):
+        with self.outputLock:
+            self.out.write(line+"\n")
+            self.out.flush()
+
+    '''
+    Handle one command line. Returns False once the session should end.
+    '''
+    def handle(self,line):
+        tokens = line.split()
+        if not tokens:
+            return True
+        command = tokens[0]
+        if command == "uci":
+            self.send("id name "+engineName)
+            self.send("id author Vedant-001")
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "ucinewgame":
+            self.stopSearch()
+            self.searcher.tt.clear()
+        elif command == "position":
+            self.stopSearch()
+            self.setPosition(tokens[1:])
+        elif command == "go":
+            self.stopSearch()
+            self.go(tokens[1:])
+        elif command == "stop":
+            self.stopSearch()
+        elif command == "quit":
+            self.stopSearch()
+            return False
+        return True
+
+    '''
+    position startpos [moves ...] / position fen <6 fields> [moves ...]
+    '''
+    def setPosition(self,tokens):
+        if "moves" in tokens:
+            movesAt = tokens.index("moves")
+            moves = tokens[movesAt+1:]
+            tokens = tokens[:movesAt]
+        else:
+            moves = []
+        if tokens and tokens[0] == "fen":
+            fen = " ".join(tokens[1:])
+        else:
+            fen = chessEngine.startFen
+        try:
+            self.gamestate.loadFen(fen)
+        except (ValueError,IndexError,KeyError):
+            self.send("info string invalid fen "+fen)
+            self.gamestate.loadFen(chessEngine.startFen)
+            return
+        for notation in moves:
+            move = self.findMove(notation)
+            if move is None:
+                self.send("info string illegal move "+notation)
+                return
+            self.gamestate.makeMove(move)
+
+    '''
+    The legal move written as e2e4 / e7e8q in the current position, or None
+    '''
+    def findMove(self,notation):
+        for move in self.gamestate.getLegalMoves():
+            if move.getChessNotation() == notation:
+                return move
+        return None
+
+    def go(self,tokens):
+        options = {}
+        infinite = False
+        for i,token in enumerate(tokens):
+            if token in goIntegerOptions and i+1 < len(tokens):
+                try:
+                    options[token] = int(tokens[i+1])
+                except ValueError:
+                    pass
+            elif token == "infinite":
+                infinite = True
+
+        timeLimit = None
+        if "movetime" in options:
+            timeLimit = options["movetime"]/1000
+        elif not infinite:
+            clock = options.get("wtime" if self.gamestate.whiteToMove else "btime")
+            increment = options.get("winc" if self.gamestate.whiteToMove else "binc",0)
+            if clock is not None:
+                # spread the remaining time over the moves still to play, keeping a margin for the overhead
+                movesToGo = options.get("movestogo",30)
+                timeLimit = max(0.01,min(clock*0.8,clock/movesToGo+increment*0.75)/1000)
+        self.stopEvent.clear()
+        self.infinite = infinite
+        self.searchThread = threading.Thread(target = self.search,name = "uci-search",daemon = True,
+                                             args = (options.get("depth",chessSearch.maxPly),timeLimit,options.get("nodes"),infinite))
+        self.searchThread.start()
+
+    def search(self,maxDepth,timeLimit,nodeLimit,infinite):
+        if self.instrumentation is not None:
+            self.instrumentation.reset()
+        result = self.searcher.findBestMove(self.gamestate,maxDepth,timeLimit,nodeLimit,
+                                            onIteration = self.sendInfo,stopEvent = self.stopEvent)
+        if self.instrumentation is not None:
+            self.send("info string "+self.instrumentation.summary())
+        if infinite:
+            self.stopEvent.wait() # the protocol only allows bestmove once the GUI has said stop
+        self.send("bestmove "+(result.bestMove.getChessNotation() if result.bestMove is not None else "0000"))
+
+    def sendInfo(self,result):
+        mate = result.mateIn()
+        score = "mate %d" % mate if mate is not None else "cp %d" % result.score
+        milliseconds = int(result.seconds*1000)
+        self.send("info depth %d score %s nodes %d nps %d time %d pv %s" % (
+            result.depth,score,result.nodes,result.nodes*1000//max(milliseconds,1),milliseconds,
+            " ".join(move.getChessNotation() for move in result.pv)))
+
+    '''
+    Let a running search finish on its own limits (an infinite one is stopped)
+    '''
+    def waitForSearch(self):
+        if self.searchThread is not None and not self.infinite:
+            self.searchThread.join()
+        self.stopSearch()
+
+    '''
+    End a running search; its bestmove line is written before this returns
+    '''
+    def stopSearch(self):
+        if self.searchThread is not None:
+            self.stopEvent.set()
+            self.searchThread.join()
+            self.searchThread = None
+
+
+def main(argv = None,stdin = sys.stdin,stdout = sys.stdout):
+    parser = argparse.ArgumentParser(description = "UCI front end for the chess engine")
+    parser.add_argument("--mailbox",action = "store_true",help = "use the 8x8 board backend instead of bitboards")
+    parser.add_argument("--book",help = "opening book file to play from before searching")
+    parser.add_argument("--stats",action = "store_true",help = "count engine calls and report them after each search")
+    args = parser.parse_args(argv)
+
+    engine = UciEngine(not args.mailbox,stdout,chessBook.OpeningBook(args.book) if args.book else None,args.stats)
+    for line in stdin:
+        if not engine.handle(line):
+            break
+    else: # input ended without quit - a match runner piping a script still wants the answer
+        engine.waitForSearch()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
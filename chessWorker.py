@@ -0,0 +1,147 @@
+"""
+Background engine worker, so the pygame loop never waits on move generation or search.
+Jobs go to a thread through one queue and come back through another, which the UI polls.
+The worker keeps its own GameState and brings it level with the game by replaying the move
+log, so the two threads never touch the same board.
+
+Python threads share one interpreter lock, but the interpreter hands it back every few
+milliseconds and pygame releases it while it waits for events, so the window stays responsive
+while a deep search runs.
+"""
+
+import queue
+import threading
+
+import chessEngine
+import chessSearch
+
+# job kinds, also used as the kind of the results they produce
+movesJob,searchJob,ponderJob,infoResult = 'moves','search','ponder','info'
+
+
+class EngineWorker():
+    '''
+    submit jobs with requestMoves / requestSearch / startPondering, collect results with poll.
+    notify - optional callable run on the worker thread whenever a result is ready,
+    e.g. to post a pygame event so the UI wakes up from p.event.wait.
+    book - optional chessBook.OpeningBook the searches play from first.
+    moveCacheSize - legal move lists are kept for this many positions, so going back to a position
+    (an undo) is answered at once. 0 turns the cache off.
+    '''
+
+    def __init__(self,notify = None,ttSize = 1 << 18,book = None,moveCacheSize = 256) -> None:
+        self.notify = notify
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+        self.gamestate = chessEngine.GameState(chessEngine.MoveCache(moveCacheSize) if moveCacheSize else None)
+        self.searcher = chessSearch.Searcher(ttSize,book)
+        self.lock = threading.Lock()
+        self.lastJobId = 0
+        self.cancelledUpTo = 0 # every job with an id up to this one has been cancelled
+        self.thread = threading.Thread(target = self.run,name = "engine-worker",daemon = True)
+        self.thread.start()
+
+    '''
+    Legal moves of the position after moves (a sequence of Move objects from the start position).
+    The result payload is the list of legal moves.
+    '''
+    def requestMoves(self,moves):
+        return self.submit(movesJob,moves,{})
+
+    '''
+    Search the position after moves. options are passed on to Searcher.findBestMove
+    (maxDepth, timeLimit, nodeLimit). An info result is posted after every finished depth
+    and a search result with the final SearchResult at the end.
+    '''
+    def requestSearch(self,moves,**options):
+        return self.submit(searchJob,moves,options)
+
+    '''
+    Search the position while the human is thinking. Nothing is reported - the point is to fill
+    the transposition table so the search after the reply finishes sooner. Runs until cancelled.
+    '''
+    def startPondering(self,moves):
+        return self.submit(ponderJob,moves,{})
+
+    def submit(self,kind,moves,options):
+        with self.lock:
+            self.lastJobId += 1
+            jobId = self.lastJobId
+        self.jobs.put((kind,jobId,tuple(moves),options))
+        return jobId
+
+    '''
+    Drop every job submitted so far - queued ones are skipped, a running search is stopped
+    and results still in flight are discarded by poll
+    '''
+    def cancel(self):
+        with self.lock:
+            self.cancelledUpTo = self.lastJobId
+        self.searcher.stop()
+
+    def isCancelled(self,jobId):
+        return jobId <= self.cancelledUpTo
+
+    '''
+    Results that arrived since the last call, as (kind, jobId, payload) tuples. Never blocks.
+    '''
+    def poll(self):
+        ready = []
+        while True:
+            try:
+                result = self.results.get_nowait()
+            except queue.Empty:
+                return ready
+            if not self.isCancelled(result[1]):
+                ready.append(result)
+
+    '''
+    Stop the thread once the current job is finished or stopped
+    '''
+    def close(self):
+        self.cancel()
+        self.jobs.put(None)
+        self.thread.join()
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            kind,jobId,moves,options = job
+            if self.isCancelled(jobId):
+                continue
+            self.syncPosition(moves)
+            if kind == movesJob:
+                self.post(kind,jobId,self.gamestate.getCachedLegalMoves())
+            else:
+                def onIteration(result,jobId = jobId,kind = kind):
+                    # a cancel that lands just before the search starts is cleared by findBestMove, so look again here
+                    if self.isCancelled(jobId):
+                        self.searcher.stop()
+                    elif kind == searchJob:
+                        self.post(infoResult,jobId,result)
+                result = self.searcher.findBestMove(self.gamestate,onIteration = onIteration,**options)
+                if kind == searchJob:
+                    self.post(kind,jobId,result)
+
+    def post(self,kind,jobId,payload):
+        if self.isCancelled(jobId):
+            return
+        self.results.put((kind,jobId,payload))
+        if self.notify is not None:
+            self.notify()
+
+    '''
+    Bring the worker's own game state to the position after moves. Only the moves after the
+    last one both move lists have in common are undone and replayed.
+    '''
+    def syncPosition(self,moves):
+        log = self.gamestate.moveLog
+        common = 0
+        while common < len(log) and common < len(moves) and log[common] == moves[common]:
+            common += 1
+        while len(log) > common:
+            self.gamestate.undoMove()
+        for move in moves[common:]:
+            self.gamestate.makeMove(move)
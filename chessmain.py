@@ -1,13 +1,23 @@
 """ To display the current game state and the user input
 """
 
+import os
+
 import pygame as p
+import chessBook
 import chessEngine
+import chessWorker
 
 width = height = 512
 dimension = 8 # Chess board is of 8x8 dimension
 square_size = width//dimension
-max_fps = 15
+player_one = True # True when a human plays white, False when the engine does
+player_two = True # same for black
+ai_think_time = 2 # seconds per engine move
+ponder = False # let the engine keep searching while the human thinks
+book_path = None # opening book file for the engine, see chessBook.py
+engine_event = p.USEREVENT+1 # posted by the worker thread when a result is waiting
+image_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)),"images")
 
 images = {}
 
@@ -19,9 +29,9 @@ Will be called only once in the main - to reduce time
 def load_images():
     pieces = ["bB","bK","bN","bP","bQ","bR",
               "wB","wK","wN","wP","wQ","wR"]
-    
+
     for piece in pieces:
-        images[piece] = p.transform.scale(p.image.load("C:/Users/HP/Desktop/Coding/Game/Chess/images/"+piece+".png"),(square_size,square_size))
+        images[piece] = p.transform.scale(p.image.load(os.path.join(image_dir,piece+".png")),(square_size,square_size))
     # images["bB"] can be used to access black Bishop and similar with other pieces
 
 """
@@ -31,23 +41,53 @@ Driver Code
 def main():
     p.init()
     screen = p.display.set_mode((width,height))
-    clock = p.time.Clock()
-    screen.fill(p.Color("white"))
     gamestate = chessEngine.GameState()
-    valid_moves = gamestate.getValidMove()
+    # move generation and search run on a worker thread, which wakes the event loop up when it has a result
+    book = chessBook.OpeningBook(book_path) if book_path else None
+    worker = chessWorker.EngineWorker(notify = lambda: p.event.post(p.event.Event(engine_event)),book = book)
+    worker.requestMoves(gamestate.moveLog)
+    valid_moves = [] # filled in when the worker answers, clicks do nothing until then
+    search_job = None # id of the search whose answer is played - any other search result is stale
     move_made = False # flag variable for when a move is valid
     load_images()
+    board_surface = render_board() # the empty squares never change, so they are drawn once
+    drawGameState(screen,board_surface,gamestate)
+    p.display.flip()
 
     running = True
     selected_square = () #to keep track of the last click by the user
     player_clicks = [] #to keep track of the player clicks
 
     while running:
-        for e in p.event.get():
+        # sleep until something happens, then take whatever else has queued up behind it
+        dirty_squares = set() # squares whose contents changed and have to be redrawn
+        full_redraw = False
+        for e in [p.event.wait()]+p.event.get():
             if e.type == p.QUIT:
                 running = False
+            elif e.type == p.VIDEOEXPOSE: # the window contents were lost
+                full_redraw = True
+            elif e.type == engine_event:
+                for kind,job_id,result in worker.poll():
+                    if kind == chessWorker.movesJob:
+                        valid_moves = result
+                        gamestate.updateGameStatus(valid_moves)
+                        announce_game_over(gamestate)
+                        if valid_moves and not human_turn(gamestate):
+                            search_job = worker.requestSearch(gamestate.moveLog,timeLimit = ai_think_time)
+                        elif valid_moves and ponder and not (player_one and player_two):
+                            worker.startPondering(gamestate.moveLog)
+                    elif kind == chessWorker.searchJob and job_id == search_job and result.bestMove is not None:
+                        gamestate.makeMove(result.bestMove)
+                        dirty_squares.update(move_squares(result.bestMove))
+                        move_made = True
+                        # the board changed - nothing the worker has sent or is working on applies to it now
+                        worker.cancel()
+                        valid_moves = []
+                        search_job = None
+                        break
             # mouse handlers
-            elif e.type == p.MOUSEBUTTONDOWN:
+            elif e.type == p.MOUSEBUTTONDOWN and human_turn(gamestate):
                 location = p.mouse.get_pos() # x,y location of mouse
                 row = location[1]//square_size
                 col = location[0]//square_size
@@ -67,41 +107,96 @@ def main():
                     for i in range(len(valid_moves)):
                         if move == valid_moves[i]:
                             gamestate.makeMove(valid_moves[i])
+                            dirty_squares.update(move_squares(valid_moves[i]))
                             move_made = True
+                            worker.cancel()
+                            valid_moves = []
                             selected_square = ()
                             player_clicks = [] # reset the clicks
+                            break
                     if not move_made:
                         player_clicks = [selected_square]
             # key handler
             elif e.type == p.KEYDOWN:
-                if e.key == p.K_z:
+                if e.key == p.K_z and gamestate.moveLog:
+                    dirty_squares.update(move_squares(gamestate.moveLog[-1]))
                     gamestate.undoMove()
-                    move_made = True # considering undo as a valid move 
+                    move_made = True # considering undo as a valid move
+                    # drop the old position's moves and any search still on its way, before later events in this batch
+                    worker.cancel()
+                    valid_moves = []
+                    search_job = None
     # generate valid moves only when a valid move is made
-        if move_made:
-            valid_moves = gamestate.getValidMove()
+        if move_made: # the worker was cancelled where the board changed
+            worker.requestMoves(gamestate.moveLog)
             move_made = False
 
-        drawGameState(screen,gamestate)
-        clock.tick(max_fps)
-        p.display.flip()
+        if full_redraw:
+            drawGameState(screen,board_surface,gamestate)
+            p.display.flip()
+        elif dirty_squares:
+            p.display.update([draw_square(screen,board_surface,gamestate.board,row,col) for row,col in dirty_squares])
+    worker.close()
+
+def human_turn(gamestate):
+    return player_one if gamestate.whiteToMove else player_two
+
+'''
+Say how the game ended - the window stays open, so the last moves can still be undone
+'''
+def announce_game_over(gamestate):
+    if gamestate.checkMate:
+        print("CHECKMATE")
+        print("BLACK" if gamestate.whiteToMove else "WHITE","WON!")
+    elif gamestate.staleMate:
+        print("STALEMATE!")
+
+'''
+The squares a move changes - the start and end squares, plus the captured pawn for en-passant
+and the rook's squares for castling. Undoing the move changes the same squares.
+'''
+def move_squares(move):
+    squares = [(move.start_row,move.start_col),(move.end_row,move.end_col)]
+    if move.isEnPassantMove:
+        squares.append((move.start_row,move.end_col))
+    elif move.isCastleMove:
+        if move.end_col-move.start_col == 2: # king side
+            squares += [(move.end_row,move.end_col+1),(move.end_row,move.end_col-1)]
+        else: # queen side
+            squares += [(move.end_row,move.end_col-2),(move.end_row,move.end_col+1)]
+    return squares
 
 '''
 The below function is responsible for the graphics of the current gamestate
 '''
-def drawGameState(screen,gamestate):
-    draw_board(screen) #draws the squares
+def drawGameState(screen,board_surface,gamestate):
+    screen.blit(board_surface,(0,0)) #draws the squares
     draw_pieces(screen,gamestate.board) #draws pieces on the squares
     '''Note: we draw the squares before drawing the pieces'''
 
-def draw_board(screen):
+'''
+Draw the empty board once onto its own surface
+'''
+def render_board():
+    board_surface = p.Surface((width,height))
     colors = [p.Color('white'),p.Color('dark gray')]
 
     for row in range(dimension):
         for col in range(dimension):
             square_color = colors[(row+col)%2]
-            p.draw.rect(screen,square_color,p.Rect(col*square_size,row*square_size,square_size,square_size))
-                
+            p.draw.rect(board_surface,square_color,p.Rect(col*square_size,row*square_size,square_size,square_size))
+    return board_surface
+
+'''
+Redraw a single square and its piece, returning the area of the screen that changed
+'''
+def draw_square(screen,board_surface,board,row,col):
+    rect = p.Rect(col*square_size,row*square_size,square_size,square_size)
+    screen.blit(board_surface,rect,rect) # copy the empty square over whatever was there
+    piece = board[row][col]
+    if piece != "--":
+        screen.blit(images[piece],rect)
+    return rect
 
 def draw_pieces(screen,board):
 
@@ -113,4 +208,4 @@ def draw_pieces(screen,board):
 
 # If this file is imported in another program, then it wouldn't implicitly run
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()